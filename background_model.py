@@ -0,0 +1,138 @@
+"""
+Empty table reference image (background model) for ball detection by differencing.
+/capture-table takes the median of a few frames of the empty table (a player walking past in some of them
+doesn't end up in the median) and saves it as calibration/background.png, in the orientation of the
+frames published by cv_module. Detection with DETECTION_MODE=background compares every frame with it,
+see detect_balls._find_circles_background.
+
+The detection workers load the background once and again whenever the file changes, and crop / rectify it
+again when the table calibration changes. While detecting they keep it up to date with a running average
+of the cloth around the balls, so slow lighting drift (daylight, lamps warming up) doesn't turn into false
+detections. Balls never blend into the background, the pixels around them are left out of the average.
+"""
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import settings
+import table_calibration
+
+
+class BackgroundModel:
+    """
+    The empty table in the image space detection works in (cropped / rectified like the frames detection sees).
+    """
+
+    def __init__(self, image):
+        self.image = np.ascontiguousarray(image)
+        self._average = self.image.astype(np.float32)
+        self._frames = 0
+        # Foreground grown by about a ball radius, so the shadows and blurred edges of the balls stay out of the average
+        self._dilate_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (31, 31))
+        self._background_mask = np.empty(self.image.shape[:2], np.uint8)
+
+    def refresh(self, frame, foreground):
+        """
+        Blend the cloth of a frame into the background, every BACKGROUND_REFRESH_INTERVAL frames.
+        Args:
+            frame (np.ndarray): The frame detection ran on.
+            foreground (np.ndarray): uint8 mask of the balls (and anything else) detection found, nonzero on them.
+        """
+        self._frames += 1
+        if self._frames % settings.BACKGROUND_REFRESH_INTERVAL or frame.shape != self.image.shape:
+            return
+
+        cv2.dilate(foreground, self._dilate_kernel, dst=self._background_mask)
+        cv2.bitwise_not(self._background_mask, dst=self._background_mask)
+        cv2.accumulateWeighted(frame, self._average, settings.BACKGROUND_REFRESH_RATE, mask=self._background_mask)
+        cv2.convertScaleAbs(self._average, dst=self.image)
+
+
+def build(frames):
+    """
+    Build the empty table image from frames of the empty table.
+    Returns:
+        np.ndarray: The per pixel median of the frames.
+    """
+    return np.median(np.stack(frames), axis=0).astype(np.uint8)
+
+
+def load(path=None):
+    """
+    Load the empty table image.
+    Returns:
+        np.ndarray | None: The image in frame coordinates, or None if the file doesn't exist.
+    """
+    path = Path(path or settings.BACKGROUND_FILE)
+    if not path.exists():
+        return None
+
+    image = cv2.imread(str(path))
+    if image is None:
+        print(f"Error loading the background model from {path}")
+    return image
+
+
+def save(image, path=None):
+    """Save the empty table image, losslessly."""
+    path = Path(path or settings.BACKGROUND_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(path), image)
+    print(f"Background model saved to {path}")
+
+
+_model: BackgroundModel | None = None
+_loaded_mtime = None
+# The empty table in frame coordinates, and the table calibration _model was cropped / rectified with
+_image: np.ndarray | None = None
+_model_calibration = None
+
+
+def _mtime():
+    try:
+        return os.stat(settings.BACKGROUND_FILE).st_mtime
+    except OSError:
+        return None
+
+
+def get_model():
+    """
+    Get the background model in the detection image space (loaded on first use, and again when the file changes).
+    It is rebuilt from the empty table when the table calibration changes.
+    Returns:
+        BackgroundModel | None: The model, or None if no empty table has been captured.
+    """
+    if _mtime() != _loaded_mtime:
+        image = load() if _mtime() is not None else None
+        set_model(image)
+        if _model is not None:
+            print(f"Background model loaded from {settings.BACKGROUND_FILE}")
+    elif _image is not None and table_calibration.get_calibration() is not _model_calibration:
+        _build()
+        print("Table calibration changed, background model rebuilt")
+    return _model
+
+
+def set_model(image):
+    """
+    Use image (frame coordinates) as the empty table, e.g. a synthetic table's empty render in benchmarks.
+    It is used until BACKGROUND_FILE changes.
+    """
+    global _image, _loaded_mtime
+    _loaded_mtime = _mtime()
+    _image = image
+    _build()
+
+
+def _build():
+    """Crop / rectify the empty table with the current table calibration."""
+    global _model, _model_calibration
+    _model_calibration = table_calibration.get_calibration()
+    if _image is None:
+        _model = None
+    elif _model_calibration is not None:
+        _model = BackgroundModel(_model_calibration.detection_image(_image))
+    else:
+        _model = BackgroundModel(_image)
@@ -3,56 +3,66 @@
 import cv2
 import numpy as np
 import time
+import color_model
+import detector_params
+from stage_timing import stage
 
-def find_color_balls(image: np.ndarray, color_ranges: dict) -> list:
+def find_color_balls(image: np.ndarray, color_ranges: dict | None, mask: np.ndarray | None = None) -> list:
     """
     Find colored balls in the image using color ranges and Hough Circle Transform.
     :param image: Input image (BGR format).
     :param color_ranges: Dictionary containing low and high HSV ranges for the wanted color.
+    :param mask: Mask of the color's pixels (from the color lookup table), used instead of color_ranges.
     :return: List of detected circles with their positions and radii.
     """
-    # Step 0: Convert the image to HSV color space
-    hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    if mask is None:
+        # Step 0: Convert the image to HSV color space
+        with stage("color_convert"):
+            hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
-    # Step 1: Get color mask
-    low_range1 = color_ranges["low1"]
-    upper_range1 = color_ranges["high1"]
-    mask1 = cv2.inRange(hsv_image, low_range1, upper_range1)
+        with stage("color_mask"):
+            # Step 1: Get color mask
+            low_range1 = color_ranges["low1"]
+            upper_range1 = color_ranges["high1"]
+            mask1 = cv2.inRange(hsv_image, low_range1, upper_range1)
 
-    # This is only used for red balls with split HSV range
-    if "low2" in color_ranges and "high2" in color_ranges:
-        low_range2 = np.array(color_ranges["low2"])
-        upper_range2 = np.array(color_ranges["high2"])
-        mask2 = cv2.inRange(hsv_image, low_range2, upper_range2)
-        mask = cv2.bitwise_or(mask1, mask2) # Combine masks
-    else:
-        mask = mask1
+            # This is only used for red balls with split HSV range
+            if "low2" in color_ranges and "high2" in color_ranges:
+                low_range2 = np.array(color_ranges["low2"])
+                upper_range2 = np.array(color_ranges["high2"])
+                mask2 = cv2.inRange(hsv_image, low_range2, upper_range2)
+                mask = cv2.bitwise_or(mask1, mask2) # Combine masks
+            else:
+                mask = mask1
 
-    # Step 2: Clean the mask
-    kernel = np.ones((5, 5), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    with stage("color_mask"):
+        # Step 2: Clean the mask
+        kernel = np.ones((5, 5), np.uint8)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
     
-    # Step 3: Apply mask to image
-    masked = cv2.bitwise_and(image, image, mask=mask)
+    with stage("blur"):
+        # Step 3: Apply mask to image
+        masked = cv2.bitwise_and(image, image, mask=mask)
 
-    # Step 4: Convert to grayscale for HoughCircles
-    gray = cv2.cvtColor(masked, cv2.COLOR_BGR2GRAY)
+        # Step 4: Convert to grayscale for HoughCircles
+        gray = cv2.cvtColor(masked, cv2.COLOR_BGR2GRAY)
     
-    # Step 5: Blur to improve circle detection
-    blurred = cv2.GaussianBlur(gray, (5, 5), 2)
+        # Step 5: Blur to improve circle detection
+        blurred = cv2.GaussianBlur(gray, (5, 5), 2)
 
     # Step 6: Detect circles using Hough Circle Transform
-    circles = cv2.HoughCircles(
-        blurred,                   # Input image (grayscale and blurred)
-        cv2.HOUGH_GRADIENT,      # Detection method: HOUGH_GRADIENT is standard and effective
-        dp=1.2,                  
-        minDist=50,              # Minimum distance between the centers of detected circles.
-        param1=100,              # This is the upper threshold for the internal Canny edge detector.
-        param2=30,               # Threshold for center detection — lower = more sensitive (more false circles), higher = stricter (fewer but more confident circles).
-        minRadius=20,            # Minimum circle radius (in pixels). Prevents detecting tiny noise blobs.
-        maxRadius=29             # Maximum circle radius (in pixels). Prevents detecting giant false circles.
-    )
+    with stage("hough"):
+        circles = cv2.HoughCircles(
+            blurred,                   # Input image (grayscale and blurred)
+            cv2.HOUGH_GRADIENT,      # Detection method: HOUGH_GRADIENT is standard and effective
+            dp=1.2,                  
+            minDist=50,              # Minimum distance between the centers of detected circles.
+            param1=100,              # This is the upper threshold for the internal Canny edge detector.
+            param2=30,               # Threshold for center detection — lower = more sensitive (more false circles), higher = stricter (fewer but more confident circles).
+            minRadius=20,            # Minimum circle radius (in pixels). Prevents detecting tiny noise blobs.
+            maxRadius=29             # Maximum circle radius (in pixels). Prevents detecting giant false circles.
+        )
 
     # Step 7: Convert circles to a list of dictionaries. Dict = one ball, List = all balls of this color
     circles_to_return = []
@@ -65,78 +75,270 @@ def find_color_balls(image: np.ndarray, color_ranges: dict) -> list:
 
     return circles_to_return
 
-def get_ball_positions(image):
-    """
-    Get positions of colored balls in the image.
-    :param image: Input image (BGR format).
-    :return: Dictionary containing lists of detected circles for each color.
-    """
-
-    # RANGES FOR BALLS
-    white_range = { # WORKS
+# RANGES FOR BALLS
+# low1/high1 is the HSV range of the color, low2/high2 an optional second range (red hue wraps around 180)
+BALL_COLOR_RANGES = {
+    "white": { # WORKS
         "low1": np.array([0, 0, 200]),
         "high1": np.array([180, 50, 255])
-    }
-    black_range = { # WORKS
+    },
+    "black": { # WORKS
         "low1": np.array([0, 0, 0]),
         "high1": np.array([180, 255, 60])
-    }
-    yellow_range = { # WORKS
+    },
+    "yellow": { # WORKS
         "low1": np.array([15, 100, 100]),
         "high1": np.array([55, 255, 255])
-    }
-    green_range = { # WORKS
+    },
+    "green": { # WORKS
         "low1": np.array([50, 50, 50]),
         "high1": np.array([110, 255, 220])
-    }
-    orange_range = { # WORKS
-        "low1": np.array([1750, 0, 0]),
+    },
+    "orange": { # WORKS
+        "low1": np.array([175, 0, 0]),
         "high1": np.array([180, 255, 255]),
         "low2": np.array([0, 0, 0]),
         "high2": np.array([10, 255, 255])
-    }
-    blue_range = { # WORKS
+    },
+    "blue": { # WORKS
         "low1": np.array([110, 100, 50]),
         "high1": np.array([130, 255, 255])
-    }
-    purple_range = { # WORKS
+    },
+    "purple": { # WORKS
         "low1": np.array([120, 130, 50]),
         "high1": np.array([170, 255, 230])
-    }
-    red_range = { # WORKS
+    },
+    "red": { # WORKS
         "low1": np.array([0, 150, 220]),
         "high1": np.array([10, 255, 255]),
         "low2": np.array([170, 150, 220]),
         "high2": np.array([180, 255, 255])
-    }
-    dark_red_range = { # WORKS
+    },
+    "dark_red": { # WORKS
         "low1": np.array([0, 180, 50]),
         "high1": np.array([10, 255, 210]),
         "low2": np.array([160, 180, 50]),
         "high2": np.array([180, 255, 210])
-    }
+    },
+}
+
 
+def get_ball_positions(image):
+    """
+    Get positions of colored balls in the image.
+    :param image: Input image (BGR format).
+    :return: Dictionary containing lists of detected circles for each color.
+    """
     # Create a dictionary to hold the detected circles for each color
     # Each color will have a list of circles, where each circle is a dictionary with keys "x", "y", and "r"
-    circles_dict = {
-        "white": find_color_balls(image, white_range),
-        "black": find_color_balls(image, black_range),
-        "yellow": find_color_balls(image, yellow_range),
-        "green": find_color_balls(image, green_range),
-        "orange": find_color_balls(image, orange_range),
-        "blue": find_color_balls(image, blue_range),
-        "purple": find_color_balls(image, purple_range),
-        "red": find_color_balls(image, red_range),
-        "dark_red": find_color_balls(image, dark_red_range),
-    }
+    circles_dict = {}
+    labels = _label_image(image)
+    if labels is not None:
+        # Calibrated colors: the masks come from the color of every pixel, classified once
+        for index, color in color_model.get_lut().ball_colors:
+            circles_dict[color] = find_color_balls(image, None, cv2.compare(labels, index, cv2.CMP_EQ))
+        return circles_dict
+
+    for color, color_ranges in BALL_COLOR_RANGES.items():
+        circles_dict[color] = find_color_balls(image, color_ranges)
 
     return circles_dict
 
 
-def test_ball_tracking(source: int | str = 0):
+def _label_image(image):
+    """
+    Classify every pixel with the calibrated color lookup table (color_model.py).
+    With it the balls are named after the snooker colors (brown, pink) instead of the names below.
+    :return: Index of every pixel's color in the table, or None if the colors have not been calibrated.
+    """
+    lut = color_model.get_lut()
+    if lut is None:
+        return None
+    with stage("color_mask"):
+        return lut.label_image(image)
+
+
+def _build_range_luts(color_ranges_by_color: dict) -> tuple:
+    """
+    Turn the HSV ranges into one 256 entry lookup table per channel.
+    Every range gets one bit: a pixel is inside range i if bit i is set in the H, S and V lookups of its values.
+    :return: ([H, S, V] uint16 LUTs for cv2.LUT, {color: bits of its ranges})
+    """
+    luts = [np.zeros(256, np.uint16) for _ in range(3)]
+    color_bits = {}
+    values = np.arange(256)
+    bit = 0
+    for color, color_ranges in color_ranges_by_color.items():
+        color_bits[color] = 0
+        for low_key, high_key in (("low1", "high1"), ("low2", "high2")):
+            if low_key not in color_ranges:
+                continue
+            low, high = color_ranges[low_key], color_ranges[high_key]
+            for channel, lut in enumerate(luts):
+                lut[(values >= low[channel]) & (values <= high[channel])] |= 1 << bit
+            color_bits[color] |= 1 << bit
+            bit += 1
+    if bit > 16:
+        raise ValueError("Too many HSV ranges for a 16 bit lookup table")
+    return luts, color_bits
+
+
+def set_color_ranges(color_ranges: dict):
+    """
+    Replace (or add) the HSV ranges of the given colors, e.g. with tuned ranges, and rebuild the lookup tables.
+    :param color_ranges: {color: {"low1": [h, s, v], "high1": [h, s, v], optional "low2" / "high2"}},
+        a color mapped to None is removed (its tuned range is stored under another name).
+    """
+    global _RANGE_LUTS, _COLOR_BITS
+    for color, ranges in color_ranges.items():
+        if ranges is None:
+            BALL_COLOR_RANGES.pop(color, None)
+            continue
+        BALL_COLOR_RANGES[color] = {key: np.array(value) for key, value in ranges.items()}
+    _RANGE_LUTS, _COLOR_BITS = _build_range_luts(BALL_COLOR_RANGES)
+
+
+# Ranges tuned for the hall's lighting (tune_detector.py) override the ones above
+set_color_ranges(detector_params.get("ball_recognition", "color_ranges") or {})
+
+# Ball area limits, from the radius limits of find_color_balls (20-29 px).
+# A blob bigger than one ball (touching balls, or a ball merged with something of its color) is split with HoughCircles.
+_MIN_BALL_AREA = 0.5 * np.pi * 20 ** 2
+_MAX_BALL_AREA = 1.3 * np.pi * 29 ** 2
+
+# HSV distance from the cloth's median color within which a pixel is cloth
+_CLOTH_TOLERANCE = np.array([10, 60, 60])
+# A found ball claims its circle grown by this much, so its dark rim isn't found again as a ball of no color
+_CLAIM_MARGIN = 6
+
+
+def _cloth_mask(hsv_image: np.ndarray) -> np.ndarray:
+    """
+    Mask of the cloth: the pixels close to the median color of the image, which is mostly cloth.
+    Without it the green range takes the whole cloth as one blob, with the green ball inside it.
+    """
+    median = np.median(hsv_image[::8, ::8].reshape(-1, 3), axis=0)
+    return cv2.inRange(hsv_image, np.clip(median - _CLOTH_TOLERANCE, 0, 255), np.clip(median + _CLOTH_TOLERANCE, 0, 255))
+
+
+def _clean_mask(mask: np.ndarray, kernel: np.ndarray) -> np.ndarray:
+    """
+    Close, then open the mask. Closing first fills a ball whose color sits on the edge of its range
+    (noise puts every other pixel outside it), before opening removes the specks.
+    """
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    return cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+
+def get_ball_positions_single_pass(image):
+    """
+    Faster variant of get_ball_positions with the same output shape.
+    The image is converted to HSV once and every pixel gets the bits of the color ranges it falls in
+    with a single lookup per channel (or its color from the calibrated color lookup table). Balls are then found per color as blobs of the cleaned mask,
+    measured from their moments. HoughCircles only runs on blobs too big to be one ball (touching balls).
+    With the HSV ranges the cloth is masked out first, and the blobs of no color range that are left
+    are returned as color_model.UNKNOWN balls.
+    :param image: Input image (BGR format).
+    :return: Dictionary containing lists of detected circles for each color.
+    """
+    kernel = np.ones((5, 5), np.uint8)
+    circles_dict = {}
+    labels = _label_image(image)
+    if labels is not None:
+        for index, color in color_model.get_lut().ball_colors:
+            with stage("color_mask"):
+                mask = _clean_mask(cv2.compare(labels, index, cv2.CMP_EQ), kernel)
+            circles_dict[color] = _find_balls_in_mask(image, mask)
+        return circles_dict
+
+    with stage("color_convert"):
+        hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # Range bits of every pixel: the range is hit in all three channels
+    with stage("color_mask"):
+        channel_bits = [cv2.LUT(channel, lut) for channel, lut in zip(cv2.split(hsv_image), _RANGE_LUTS)]
+        range_bits = cv2.bitwise_and(cv2.bitwise_and(channel_bits[0], channel_bits[1]), channel_bits[2])
+        not_cloth = cv2.bitwise_not(_cloth_mask(hsv_image))
+
+    # (pixels of the ball in the color's ranges, color, ball) of every ball found in any color
+    candidates = []
+    for color, bits in _COLOR_BITS.items():
+        with stage("color_mask"):
+            in_range = cv2.compare(cv2.bitwise_and(range_bits, bits), 0, cv2.CMP_NE)
+            cv2.bitwise_and(in_range, not_cloth, dst=in_range)
+            mask = _clean_mask(in_range, kernel)
+        circles_dict[color] = []
+        for ball in _find_balls_in_mask(image, mask):
+            x, y, r = ball["x"], ball["y"], ball["r"]
+            candidates.append((cv2.countNonZero(in_range[max(y - r, 0) : y + r, max(x - r, 0) : x + r]), color, ball))
+
+    # The ranges overlap (white is also orange, brown at the edge of its hue also purple): a ball found
+    # in several colors gets the color whose ranges cover most of its pixels
+    claimed = np.zeros(image.shape[:2], np.uint8)
+    for _, color, ball in sorted(candidates, key=lambda candidate: -candidate[0]):
+        if claimed[ball["y"], ball["x"]]:
+            continue
+        circles_dict[color].append(ball)
+        cv2.circle(claimed, (ball["x"], ball["y"]), ball["r"] + _CLAIM_MARGIN, 255, cv2.FILLED)
+
+    # Balls of no color range (e.g. pink with the default ranges) are what is left of the non-cloth pixels
+    with stage("color_mask"):
+        mask = _clean_mask(cv2.bitwise_and(not_cloth, cv2.bitwise_not(claimed)), kernel)
+    unknown = _find_balls_in_mask(image, mask)
+    if unknown:
+        circles_dict[color_model.UNKNOWN] = unknown
+
+    return circles_dict
+
+
+def _find_balls_in_mask(image: np.ndarray, mask: np.ndarray) -> list:
+    """
+    Find balls as blobs (outer contours) of a color mask.
+    Blobs of one ball are measured directly from their moments, bigger blobs are verified with HoughCircles.
+    :return: List of {"x", "y", "r"} dictionaries like find_color_balls.
+    """
+    with stage("contours"):
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    circles_to_return = []
+    for contour in contours:
+        moments = cv2.moments(contour)
+        area = moments["m00"]
+        if area < _MIN_BALL_AREA:
+            continue
+
+        x, y, w, h = cv2.boundingRect(contour)
+        if area <= _MAX_BALL_AREA and 0.6 <= w / h <= 1.6:
+            cx, cy = moments["m10"] / area, moments["m01"] / area
+            r = np.sqrt(area / np.pi)
+            circles_to_return.append({"x": int(round(cx)), "y": int(round(cy)), "r": int(round(r))})
+            continue
+
+        # Touching balls, or balls merged with something of their color: split the blob with HoughCircles
+        # on its bounding box, like find_color_balls does on the whole image
+        pad = 30
+        x1, y1 = max(x - pad, 0), max(y - pad, 0)
+        x2, y2 = min(x + w + pad, mask.shape[1]), min(y + h + pad, mask.shape[0])
+        blob_mask = np.zeros((y2 - y1, x2 - x1), np.uint8)
+        cv2.drawContours(blob_mask, [contour], -1, 255, cv2.FILLED, offset=(-x1, -y1))
+        roi = image[y1:y2, x1:x2]
+        masked = cv2.bitwise_and(roi, roi, mask=blob_mask)
+        gray = cv2.cvtColor(masked, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (5, 5), 2)
+        with stage("hough"):
+            circles = cv2.HoughCircles(blurred, cv2.HOUGH_GRADIENT, dp=1.2, minDist=50, param1=100, param2=30, minRadius=20, maxRadius=29)
+        if circles is not None:
+            for cx, cy, r in np.around(circles[0]).astype(int):
+                circles_to_return.append({"x": int(cx) + x1, "y": int(cy) + y1, "r": int(r)})
+
+    return circles_to_return
+
+
+def test_ball_tracking(source: int | str = 0, single_pass: bool = False):
     """
     Test function to track balls in a video stream or static image.
     :param source: Camera index (int) or "i" for static image.
+    :param single_pass: Use get_ball_positions_single_pass instead of get_ball_positions.
     :return: None
     """
     print("Starting ball tracking... Press 'ESC' to exit.")
@@ -184,7 +386,7 @@ def test_ball_tracking(source: int | str = 0):
         #   "black": [{"x": x-coord, "y": y-coord, "r": radius}, {possibly another ball}, ],
         #   ...  
         #   }
-        circles_dict = get_ball_positions(frame)
+        circles_dict = get_ball_positions_single_pass(frame) if single_pass else get_ball_positions(frame)
         for color, balls in circles_dict.items():
                 for ball in balls:
                         x = ball.get("x", 0)
@@ -0,0 +1,137 @@
+"""
+Frame-to-frame ball tracking on top of detect_balls.
+Full detection only runs every few frames (or when a ball is lost); on the frames in between only
+small windows around the positions predicted from each ball's velocity are searched. Every ball keeps
+a stable id for as long as it is tracked, so the overlay labels don't jump between balls.
+"""
+import numpy as np
+
+from detection_executor import DetectionResult
+
+
+class Track:
+    """One tracked ball with a constant velocity motion model."""
+
+    def __init__(self, track_id, x, y, color, timestamp):
+        self.id = track_id
+        self.x, self.y = float(x), float(y)
+        self.vx = self.vy = 0.0
+        self.color = color
+        self.timestamp = timestamp
+        self.misses = 0
+
+    def predict(self, timestamp):
+        """
+        Returns:
+            tuple: Predicted (x, y) at the given time.
+        """
+        dt = timestamp - self.timestamp
+        return self.x + self.vx * dt, self.y + self.vy * dt
+
+    def update(self, x, y, color, timestamp):
+        if timestamp < self.timestamp:
+            # A full detection of an older frame, finished after newer window searches: the ball is there,
+            # but its newer position stays
+            self.misses = 0
+            return
+        dt = timestamp - self.timestamp
+        if dt > 0:
+            # Smoothed velocity, a single noisy center shouldn't send the prediction flying
+            self.vx = 0.5 * self.vx + 0.5 * (x - self.x) / dt
+            self.vy = 0.5 * self.vy + 0.5 * (y - self.y) / dt
+        self.x, self.y = float(x), float(y)
+        self.timestamp = timestamp
+        self.misses = 0
+        # Keep the last real color, an unclassified ("Color") frame doesn't relabel the ball
+        if color != "Color" or self.color == "Color":
+            self.color = color
+
+
+class BallTracker:
+    """
+    Decides per frame between full detection and a window search (plan()),
+    and turns detection results into tracked balls with stable ids (update()).
+    """
+
+    def __init__(self, full_detection_interval=10, search_radius=15, max_distance=40, max_misses=2):
+        self.full_detection_interval = full_detection_interval
+        self.search_radius = search_radius
+        self.max_distance = max_distance
+        self.max_misses = max_misses
+        self.tracks: dict[int, Track] = {}
+        self._next_id = 1
+        self._last_full_seq = None
+        self._lost = False
+
+    def plan(self, frame):
+        """
+        Decide how to detect balls in a frame.
+        Returns:
+            tuple | None: None for a full detection, otherwise (track ids, predicted (x, y) centers) to search around.
+        """
+        full_due = self._last_full_seq is None or frame.seq - self._last_full_seq >= self.full_detection_interval
+        if full_due or self._lost or not self.tracks:
+            self._last_full_seq = frame.seq
+            self._lost = False
+            return None
+
+        track_ids = list(self.tracks)
+        centers = [self.tracks[track_id].predict(frame.timestamp) for track_id in track_ids]
+        return track_ids, centers
+
+    def update(self, result, track_ids=None):
+        """
+        Update the tracks with a detection result.
+        Args:
+            result (DetectionResult): Full detection result, or a window search result aligned with track_ids (None where lost).
+            track_ids (list | None): The track ids of a window search, None for full detection.
+        Returns:
+            DetectionResult: Positions and ids of every ball that is currently tracked.
+        """
+        if track_ids is None:
+            self._match(result.positions, result.timestamp)
+        else:
+            for track_id, ball in zip(track_ids, result.positions):
+                track = self.tracks.get(track_id)
+                if track is None:
+                    continue
+                if ball is None:
+                    # Lost (potted, hidden by a player or knocked out of the window): full detection next frame
+                    track.misses += 1
+                    self._lost = True
+                else:
+                    track.update(*ball, result.timestamp)
+
+        visible = [track for track in self.tracks.values() if track.misses == 0]
+        positions = [(int(round(track.x)), int(round(track.y)), track.color) for track in visible]
+        return DetectionResult(result.seq, result.timestamp, positions, ids=[track.id for track in visible])
+
+    def _match(self, positions, timestamp):
+        """Greedily match detections to the nearest predicted track positions, start tracks for the rest."""
+        tracks = list(self.tracks.values())
+        matched_tracks = set()
+        matched_balls = set()
+
+        if tracks and positions:
+            predicted = np.array([track.predict(timestamp) for track in tracks])
+            detected = np.array([(x, y) for x, y, _ in positions], dtype=float)
+            distances = np.linalg.norm(predicted[:, None, :] - detected[None, :, :], axis=2)
+            for t, b in zip(*np.unravel_index(np.argsort(distances, axis=None), distances.shape)):
+                if distances[t, b] > self.max_distance:
+                    break
+                if t in matched_tracks or b in matched_balls:
+                    continue
+                tracks[t].update(*positions[b], timestamp)
+                matched_tracks.add(t)
+                matched_balls.add(b)
+
+        for t, track in enumerate(tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    del self.tracks[track.id]
+
+        for b, (x, y, color) in enumerate(positions):
+            if b not in matched_balls:
+                self.tracks[self._next_id] = Track(self._next_id, x, y, color, timestamp)
+                self._next_id += 1
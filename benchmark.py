@@ -0,0 +1,280 @@
+"""
+Benchmark the ball detectors stage by stage on a recorded (or synthetic) frame set.
+Every detector runs over the same frames; per stage (color convert, blur, Hough, color classification, ...)
+the latency percentiles are reported, plus frames/sec, peak memory and bytes allocated per frame (tracemalloc)
+per detector. The capture path (frame source reads, with and without a reused buffer) is measured the same way.
+Results are saved as JSON, and compared against an earlier run with --baseline.
+
+    python benchmark.py --source video --path recordings/break.mp4 --output benchmarks/before.json
+    python benchmark.py --source video --path recordings/break.mp4 --baseline benchmarks/before.json
+
+Without --source the frames come from the synthetic table (frame_sources.SyntheticTableSource).
+detect_balls_background compares with the empty table at BACKGROUND_FILE (the empty synthetic table without --source).
+"""
+import argparse
+import json
+import os
+import platform
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import background_model
+import ball_recognition_test
+import detect_balls
+import frame_sources
+import settings
+import stage_timing
+
+
+def _with_detection_mode(mode, detect):
+    """Run detect with settings.DETECTION_MODE temporarily set to mode."""
+    def run(frame):
+        previous, settings.DETECTION_MODE = settings.DETECTION_MODE, mode
+        try:
+            return detect(frame)
+        finally:
+            settings.DETECTION_MODE = previous
+    return run
+
+
+DETECTORS = {
+    "detect_balls": _with_detection_mode("full", detect_balls.get_ball_positions),
+    "detect_balls_pyramid": _with_detection_mode("pyramid", detect_balls.get_ball_positions),
+    "detect_balls_background": _with_detection_mode("background", detect_balls.get_ball_positions),
+    "detect_balls_tiled": _with_detection_mode("tiled", detect_balls.get_ball_positions),
+    "detect_balls_test": lambda frame: detect_balls.test_get_ball_positions(frame, show=False),
+    "ball_recognition": ball_recognition_test.get_ball_positions,
+    "ball_recognition_single_pass": ball_recognition_test.get_ball_positions_single_pass,
+}
+
+
+def count_balls(result):
+    """detect_balls returns a list of balls, ball_recognition_test a dict of lists per color."""
+    if isinstance(result, dict):
+        return sum(len(balls) for balls in result.values())
+    return len(result)
+
+
+def open_source(source, path, size=(1280, 720)):
+    """
+    Args:
+        size (tuple): (width, height) of the synthetic table.
+    Returns:
+        frame_sources.FrameSource: The source of the frame set, playing as fast as possible and not looping.
+    """
+    if source == "video":
+        return frame_sources.VideoFileSource(path, realtime=False, loop=False)
+    if source == "images":
+        return frame_sources.ImageDirectorySource(path, realtime=False, loop=False)
+    return frame_sources.SyntheticTableSource(size=size, realtime=False)
+
+
+def load_frames(source, path, count, size=(1280, 720)):
+    """
+    Read the frame set into memory up front, so decoding is not part of the measurements.
+    Returns:
+        list: Up to count frames.
+    """
+    frame_source = open_source(source, path, size)
+    frames = []
+    while len(frames) < count:
+        frame = frame_source.read()
+        if frame is None:
+            break
+        frames.append(frame)
+    frame_source.release()
+    return frames
+
+
+def summarize(seconds):
+    """
+    Returns:
+        dict: mean and p50 / p90 / p99 / max of the durations, in milliseconds.
+    """
+    ms = np.array(seconds) * 1000
+    summary = {"mean": float(ms.mean())}
+    for p in (50, 90, 99):
+        summary[f"p{p}"] = float(np.percentile(ms, p))
+    summary["max"] = float(ms.max())
+    return summary
+
+
+def measure_allocations(step, items):
+    """
+    Run step on every item with tracemalloc on (NumPy and OpenCV arrays are traced too).
+    Returns:
+        tuple: (peak traced memory, mean bytes allocated per item on top of what was live before it)
+    """
+    allocated = []
+    # reset_peak() before every item clears the overall peak too, so it is kept here
+    overall_peak = 0
+    tracemalloc.start()
+    try:
+        for item in items:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            step(item)
+            _, peak = tracemalloc.get_traced_memory()
+            allocated.append(peak - before)
+            overall_peak = max(overall_peak, peak)
+    finally:
+        tracemalloc.stop()
+    return overall_peak, int(np.mean(allocated)) if allocated else 0
+
+
+def benchmark_detector(detect, frames, warmup=3, memory_frames=10):
+    """
+    Time a detector over the frames, then measure its memory in a separate pass
+    (tracemalloc slows Python code down, so it is not on while timing).
+    Returns:
+        dict: fps, frame and per stage latency summaries, balls per frame, peak memory and bytes allocated per frame.
+    """
+    for frame in frames[:warmup]:
+        detect(frame)
+
+    frame_times = []
+    stage_times: dict[str, list[float]] = {}
+    balls = 0
+    for frame in frames:
+        with stage_timing.collect() as durations:
+            start = time.perf_counter()
+            balls += count_balls(detect(frame))
+            frame_times.append(time.perf_counter() - start)
+        for name, seconds in durations.items():
+            stage_times.setdefault(name, []).append(seconds)
+
+    peak, allocated = measure_allocations(detect, frames[:memory_frames])
+
+    return {
+        "fps": len(frames) / sum(frame_times),
+        "frame_ms": summarize(frame_times),
+        # Stages that don't run on every frame (e.g. Hough on touching balls) are summarized over the frames they ran in
+        "stages_ms": {name: summarize(times) for name, times in sorted(stage_times.items())},
+        "balls_per_frame": balls / len(frames),
+        "peak_memory_bytes": peak,
+        "allocated_bytes_per_frame": allocated,
+    }
+
+
+def benchmark_capture(source, path, frames=50, warmup=3, size=(1280, 720)):
+    """
+    Measure the frame source reads of the capture path: read() returning a new frame every time
+    against read(image=buffer) writing into the same buffer, like CameraStream does with its ring slots.
+    Returns:
+        dict: Frame latency summary and bytes allocated per frame of "read" and "read_into_buffer".
+    """
+    results = {}
+    for name, into_buffer in (("read", False), ("read_into_buffer", True)):
+        frame_source = open_source(source, path, size)
+        buffer = frame_source.read()
+        if buffer is None:
+            return {}
+        for _ in range(warmup):
+            frame_source.read(buffer if into_buffer else None)
+
+        def read(_):
+            return frame_source.read(buffer if into_buffer else None)
+
+        frame_times = []
+        for _ in range(frames):
+            start = time.perf_counter()
+            read(None)
+            frame_times.append(time.perf_counter() - start)
+        _, allocated = measure_allocations(read, range(min(frames, 10)))
+        frame_source.release()
+        results[name] = {"frame_ms": summarize(frame_times), "allocated_bytes_per_frame": allocated}
+    return results
+
+
+def _change(new, old):
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def print_report(results, baseline=None):
+    """Print every detector's results, with the change against the baseline run if there is one."""
+    baseline_detectors = (baseline or {}).get("detectors", {})
+    for name, result in results["detectors"].items():
+        old = baseline_detectors.get(name)
+        compare = (lambda new, key: f"  ({_change(new, key(old))})") if old else (lambda new, key: "")
+
+        print(f"\n{name}")
+        print(f"  {result['fps']:.1f} fps{compare(result['fps'], lambda r: r['fps'])}, "
+              f"{result['balls_per_frame']:.1f} balls/frame, "
+              f"peak memory {result['peak_memory_bytes'] / 1024 / 1024:.1f} MiB"
+              f"{compare(result['peak_memory_bytes'], lambda r: r['peak_memory_bytes'])}, "
+              f"allocated {result['allocated_bytes_per_frame'] / 1024:.0f} KiB/frame"
+              f"{compare(result['allocated_bytes_per_frame'], lambda r: r.get('allocated_bytes_per_frame', 0))}")
+        rows = [("frame", result["frame_ms"], lambda r: r["frame_ms"])]
+        rows += [(stage, summary, lambda r, stage=stage: r["stages_ms"].get(stage)) for stage, summary in result["stages_ms"].items()]
+        for label, summary, key in rows:
+            old_summary = key(old) if old else None
+            change = f"  (p50 {_change(summary['p50'], old_summary['p50'])})" if old_summary else ""
+            print(f"  {label:<22} p50 {summary['p50']:7.2f} ms  p90 {summary['p90']:7.2f} ms  p99 {summary['p99']:7.2f} ms{change}")
+
+    baseline_capture = (baseline or {}).get("capture", {})
+    if results.get("capture"):
+        print("\ncapture (frame source reads)")
+    for name, result in results.get("capture", {}).items():
+        old = baseline_capture.get(name)
+        allocated = result["allocated_bytes_per_frame"]
+        change = f"  ({_change(allocated, old['allocated_bytes_per_frame'])})" if old else ""
+        print(f"  {name:<22} p50 {result['frame_ms']['p50']:7.2f} ms  allocated {allocated / 1024:8.0f} KiB/frame{change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", choices=("synthetic", "video", "images"), default="synthetic")
+    parser.add_argument("--path", help="Video file or JPEG directory of --source video / images")
+    parser.add_argument("--frames", type=int, default=200, help="Number of frames to benchmark on")
+    parser.add_argument("--size", default="1280x720", help="Frame size of the synthetic table, e.g. 1920x1080 or 3840x2160")
+    parser.add_argument("--detectors", nargs="+", choices=DETECTORS, default=list(DETECTORS))
+    parser.add_argument("--threads", type=int, help="OpenCV threads (detection workers use 1)")
+    parser.add_argument("--output", default="benchmark.json", help="Where to save the results")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    if args.source != "synthetic" and not args.path:
+        parser.error(f"--source {args.source} needs --path")
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    size = tuple(int(n) for n in args.size.lower().split("x"))
+    frames = load_frames(args.source, args.path, args.frames, size)
+    if args.source == "synthetic":
+        background_model.set_model(frame_sources.SyntheticTableSource(size=size).render([]))
+    if not frames:
+        print("No frames to benchmark")
+        return
+    print(f"Benchmarking {len(args.detectors)} detector(s) on {len(frames)} frames ({frames[0].shape[1]}x{frames[0].shape[0]})")
+
+    results = {
+        "source": args.source,
+        "path": args.path,
+        "frames": len(frames),
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+        "machine": f"{platform.machine()} {platform.processor()}".strip(),
+        "cpus": os.cpu_count(),
+        "table_calibration": Path(settings.TABLE_CALIBRATION_FILE).exists(),
+        "detectors": {},
+        "capture": benchmark_capture(args.source, args.path, size=size),
+    }
+    for name in args.detectors:
+        print(f"Running {name}...")
+        results["detectors"][name] = benchmark_detector(DETECTORS[name], frames)
+
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    print_report(results, baseline)
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=4))
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
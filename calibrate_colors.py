@@ -0,0 +1,242 @@
+"""
+Calibrate the ball colors for the hall's lighting and save them as the color lookup table the detectors
+load at startup (color_model.py).
+
+1. Pixels of every ball color and of the cloth are sampled, from the annotated balls of a labelled dataset
+   (ground_truth.py) or interactively from the camera, read through the same frame source the server uses.
+2. A small classifier is trained on them: one Gaussian per color in BGR, a color far from all of them is no ball.
+   The cloth is a class of its own, so the boundaries between the cloth and the green / brown / black balls
+   are learned too.
+3. The classifier is evaluated once for every quantized BGR color and saved as the lookup table.
+
+    python calibrate_colors.py --dataset datasets/hall
+    python calibrate_colors.py --camera
+
+With --camera, click every ball of the color that is asked for (Enter for the next color, Esc to cancel).
+The balls must not move while the following frames are sampled.
+"""
+import argparse
+
+import cv2
+import numpy as np
+
+import color_model
+import frame_sources
+import ground_truth
+
+COLORS = ("white", "red", "yellow", "green", "brown", "blue", "pink", "black")
+CLOTH = "cloth"
+
+# Smallest variance (per channel) of a color, so a color sampled under very even light isn't a point
+_MIN_VARIANCE = 16.0
+# Squared Mahalanobis distance beyond which a color belongs to no class (~5 standard deviations)
+_REJECT_DISTANCE = 25.0
+
+# Pixels sampled from the middle of a ball, the edge blends into the cloth and the shadow
+_SAMPLE_RADIUS = 14
+
+
+class GaussianColorClassifier:
+    """
+    One Gaussian per color in BGR space. A color gets the class of the highest likelihood,
+    or -1 if it is further than _REJECT_DISTANCE (squared Mahalanobis distance) from every class.
+    """
+
+    def __init__(self, samples):
+        """
+        Args:
+            samples (dict): Color name -> array of shape (n, 3) of its BGR pixels.
+        """
+        self.names = list(samples)
+        self._means = []
+        self._inverses = []
+        self._log_dets = []
+        for name in self.names:
+            pixels = np.asarray(samples[name], dtype=float)
+            covariance = np.cov(pixels, rowvar=False) + np.eye(3) * _MIN_VARIANCE
+            self._means.append(pixels.mean(axis=0))
+            self._inverses.append(np.linalg.inv(covariance))
+            self._log_dets.append(np.linalg.slogdet(covariance)[1])
+
+    def predict(self, colors):
+        """
+        Returns:
+            np.ndarray: Index in names of every color's class, -1 for colors of no class.
+        """
+        colors = np.asarray(colors, dtype=float)
+        distances = np.empty((len(colors), len(self.names)))
+        for i, (mean, inverse) in enumerate(zip(self._means, self._inverses)):
+            offsets = colors - mean
+            distances[:, i] = np.einsum("ij,jk,ik->i", offsets, inverse, offsets)
+
+        best = np.argmax(-0.5 * (distances + self._log_dets), axis=1)
+        rejected = distances[np.arange(len(colors)), best] > _REJECT_DISTANCE
+        return np.where(rejected, -1, best)
+
+
+def ball_pixels(frame, x, y, radius=_SAMPLE_RADIUS):
+    """BGR pixels of the disc of the given radius around (x, y), clipped to the frame."""
+    h, w = frame.shape[:2]
+    ys, xs = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+    dy, dx = np.nonzero(xs ** 2 + ys ** 2 <= radius ** 2)
+    py, px = dy - radius + y, dx - radius + x
+    inside = (py >= 0) & (py < h) & (px >= 0) & (px < w)
+    return frame[py[inside], px[inside]]
+
+
+def cloth_pixels(frame, balls, count=2000, rng=None):
+    """Random pixels at least three ball radii away from every ball."""
+    rng = rng or np.random.default_rng(0)
+    h, w = frame.shape[:2]
+    ys, xs = rng.integers(0, h, count), rng.integers(0, w, count)
+    keep = np.ones(count, bool)
+    for x, y, _ in balls:
+        keep &= np.hypot(xs - x, ys - y) > 3 * frame_sources.BALL_RADIUS
+    return frame[ys[keep], xs[keep]]
+
+
+def sample_dataset(dataset, max_pixels=20000, seed=0):
+    """
+    Sample the pixels of the annotated balls and the cloth of a dataset.
+    Returns:
+        dict: Color name (and CLOTH) -> array of shape (n, 3) of BGR pixels.
+    """
+    rng = np.random.default_rng(seed)
+    pixels: dict[str, list] = {}
+    for _, frame, balls in dataset:
+        for x, y, color in balls:
+            pixels.setdefault(color, []).append(ball_pixels(frame, x, y))
+        pixels.setdefault(CLOTH, []).append(cloth_pixels(frame, balls, rng=rng))
+
+    samples = {}
+    for color, chunks in pixels.items():
+        color_pixels = np.concatenate(chunks)
+        if len(color_pixels) > max_pixels:
+            color_pixels = color_pixels[rng.choice(len(color_pixels), max_pixels, replace=False)]
+        samples[color] = color_pixels
+    return samples
+
+
+def _read_frame(source):
+    """The next frame of a source in the app's orientation, decoding the JPEG of a pass-through source."""
+    if not source.jpeg_passthrough:
+        return source.read()
+    jpeg = source.read_jpeg()
+    if jpeg is None:
+        return None
+    frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+    if frame is not None and source.jpeg_needs_flip:
+        cv2.flip(frame, 1, dst=frame)
+    return frame
+
+
+def sample_camera(frames=30):
+    """
+    Let the user click the balls of every color (and a few spots of the cloth) on a camera frame,
+    then sample the clicked spots in the next frames.
+    Returns:
+        dict | None: Color name (and CLOTH) -> array of shape (n, 3) of BGR pixels, None if cancelled.
+    """
+    source = frame_sources.get_frame_source()
+    try:
+        frame = None
+        while frame is None:
+            frame = _read_frame(source)
+
+        window = "Calibrate colors"
+        cv2.namedWindow(window)
+        clicks = []
+        cv2.setMouseCallback(window, lambda event, x, y, *_: clicks.append((x, y)) if event == cv2.EVENT_LBUTTONDOWN else None)
+
+        spots = []
+        for color in COLORS + (CLOTH,):
+            clicks.clear()
+            print(f"Click the {color} ball(s)" if color != CLOTH else "Click a few spots of the cloth", "- Enter: next, Esc: cancel")
+            while True:
+                shown = frame.copy()
+                for x, y, _ in spots:
+                    cv2.circle(shown, (x, y), _SAMPLE_RADIUS, (255, 255, 255), 1)
+                for x, y in clicks:
+                    cv2.circle(shown, (x, y), _SAMPLE_RADIUS, (0, 0, 255), 2)
+                cv2.putText(shown, color, (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
+                cv2.imshow(window, shown)
+                key = cv2.waitKey(30) & 0xFF
+                if key == 27:
+                    return None
+                if key in (10, 13):
+                    break
+            spots.extend((x, y, color) for x, y in clicks)
+        cv2.destroyWindow(window)
+
+        pixels: dict[str, list] = {}
+        for _ in range(frames):
+            frame = _read_frame(source)
+            if frame is None:
+                continue
+            for x, y, color in spots:
+                pixels.setdefault(color, []).append(ball_pixels(frame, x, y))
+        return {color: np.concatenate(chunks) for color, chunks in pixels.items()}
+    finally:
+        source.release()
+
+
+def build_lut(samples):
+    """
+    Train the classifier on the samples and compile it into a lookup table. Cloth and rejected colors are UNKNOWN.
+    Returns:
+        color_model.ColorLut: The lookup table.
+    """
+    classifier = GaussianColorClassifier(samples)
+    ball_colors = [name for name in classifier.names if name != CLOTH]
+    unknown = len(ball_colors)
+    # Classifier class -> index in the table's names
+    to_table = np.array([ball_colors.index(name) if name != CLOTH else unknown for name in classifier.names] + [unknown])
+    table = color_model.compile_table(lambda colors: to_table[classifier.predict(colors)])
+    return color_model.ColorLut(table, ball_colors + [color_model.UNKNOWN])
+
+
+def report(lut, samples):
+    """Print how the table classifies the samples of every color."""
+    print(f"\n{'color':<8} {'pixels':>7} {'correct':>8}  most common mistakes")
+    for color, pixels in samples.items():
+        names = np.array(lut.classify(pixels))
+        expected = color if color != CLOTH else color_model.UNKNOWN
+        wrong, counts = np.unique(names[names != expected], return_counts=True)
+        mistakes = ", ".join(f"{name} {count / len(names):.1%}" for name, count in sorted(zip(wrong, counts), key=lambda item: -item[1])[:3])
+        print(f"{color:<8} {len(names):>7} {np.mean(names == expected):>8.1%}  {mistakes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    samples_from = parser.add_mutually_exclusive_group(required=True)
+    samples_from.add_argument("--dataset", help="Labelled dataset to sample the balls from")
+    samples_from.add_argument("--camera", action="store_true", help="Click the balls on the camera image")
+    parser.add_argument("--frames", type=int, default=30, help="Camera frames to sample the clicked balls in")
+    parser.add_argument("--output", help="Where to save the lookup table (default COLOR_LUT_FILE)")
+    args = parser.parse_args()
+
+    if args.dataset:
+        dataset = ground_truth.load_dataset(args.dataset)
+        if not dataset:
+            print(f"No frames in {args.dataset}")
+            return
+        samples = sample_dataset(dataset)
+    else:
+        samples = sample_camera(args.frames)
+        if samples is None:
+            print("Calibration cancelled")
+            return
+
+    missing = [color for color in COLORS if color not in samples]
+    if missing:
+        print(f"No samples of {', '.join(missing)}, these colors will not be recognized")
+    if CLOTH not in samples:
+        print("No samples of the cloth, cloth pixels may be taken for green balls")
+
+    lut = build_lut(samples)
+    report(lut, samples)
+    color_model.save(lut, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Check that the web server stays responsive while live video is streaming.
+Opens a few /get-live-video streams, hammers / with concurrent requests and prints
+the response time percentiles of / and the frame rate each stream received.
+
+Start the server first (python flask_app.py), then run:
+    python check_responsiveness.py [--url http://localhost:5000] [--streams 3] [--seconds 10]
+"""
+import argparse
+import threading
+import time
+import urllib.request
+
+
+def read_stream(url, stop, frame_counts, index):
+    """Read an MJPEG stream until stop is set, counting the frames received."""
+    with urllib.request.urlopen(url, timeout=10) as response:
+        while not stop.is_set():
+            line = response.readline()
+            if not line:
+                break
+            if line.startswith(b"--frame"):
+                frame_counts[index] += 1
+
+
+def hammer_index(url, stop, latencies):
+    """Request the index page back to back until stop is set, recording every response time."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        with urllib.request.urlopen(url, timeout=10) as response:
+            response.read()
+        latencies.append(time.perf_counter() - start)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--streams", type=int, default=3, help="Number of live video clients")
+    parser.add_argument("--hammers", type=int, default=4, help="Number of concurrent clients requesting /")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--profile", default="full", help="Live video profile of the stream clients")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    frame_counts = [0] * args.streams
+    latencies = []
+
+    threads = [
+        threading.Thread(target=read_stream, args=(f"{args.url}/get-live-video?profile={args.profile}", stop, frame_counts, i), daemon=True)
+        for i in range(args.streams)
+    ]
+    # Let the streams get going before measuring
+    for thread in threads:
+        thread.start()
+    time.sleep(1)
+    frame_counts[:] = [0] * args.streams
+
+    hammers = [threading.Thread(target=hammer_index, args=(f"{args.url}/", stop, latencies), daemon=True) for _ in range(args.hammers)]
+    for thread in hammers:
+        thread.start()
+
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in hammers:
+        thread.join()
+
+    if not latencies:
+        print("No responses from / at all, the server is blocked")
+        return
+
+    print(f"/ requests: {len(latencies)} ({len(latencies) / args.seconds:.1f}/s)")
+    for p in (50, 90, 99):
+        print(f"  p{p}: {percentile(latencies, p) * 1000:.1f} ms")
+    print(f"  max: {max(latencies) * 1000:.1f} ms")
+    for i, count in enumerate(frame_counts):
+        print(f"Stream {i}: {count / args.seconds:.1f} fps")
+
+
+if __name__ == "__main__":
+    main()
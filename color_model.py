@@ -0,0 +1,131 @@
+"""
+Calibrated ball color lookup table, written by calibrate_colors.py and loaded by the detectors at startup.
+The table maps every BGR color, quantized to LUT_BITS bits per channel (32 x 32 x 32 bins, 32 KiB), to the
+index of a ball color. Classifying an ROI mean, a batch of means or every pixel of a frame is one indexed lookup,
+instead of testing HSV ranges. Colors that are no ball (the cloth, cushions, anything the classifier rejects)
+map to UNKNOWN.
+
+calibration/color_lut.npz:
+    table   uint8 array (32, 32, 32) indexed by [b >> 3, g >> 3, r >> 3], values index names
+    names   the color names, the last one is UNKNOWN
+"""
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import settings
+
+LUT_BITS = 5
+_SHIFT = 8 - LUT_BITS
+_BINS = 1 << LUT_BITS
+
+# Name of colors that are no ball, detect_balls calls an unmatched color the same
+UNKNOWN = "Color"
+
+
+class ColorLut:
+    """
+    Quantized BGR -> ball color lookup table.
+    """
+
+    def __init__(self, table, names):
+        self.table = np.ascontiguousarray(table, dtype=np.uint8)
+        self.names = np.array(names)
+        self.unknown = len(self.names) - 1
+        self._flat = self.table.ravel()
+        # Per channel lookups that turn a pixel into its bin's index in the flattened table with cv2.LUT
+        values = np.arange(256, dtype=np.uint16) >> _SHIFT
+        self._index_lut = np.stack([values << (2 * LUT_BITS), values << LUT_BITS, values], axis=1).reshape(256, 1, 3)
+
+    @property
+    def ball_colors(self):
+        """(index, name) of every ball color in the table."""
+        return [(index, str(name)) for index, name in enumerate(self.names[:-1])]
+
+    def classify(self, colors):
+        """
+        Args:
+            colors (np.ndarray): uint8 array of shape (n, 3) of BGR colors, e.g. ROI means.
+        Returns:
+            list: Color name of each color, UNKNOWN if it is no ball.
+        """
+        bins = np.asarray(colors, dtype=np.uint8).reshape(-1, 3) >> _SHIFT
+        return self.names[self.table[bins[:, 0], bins[:, 1], bins[:, 2]]].tolist()
+
+    def label_image(self, image):
+        """
+        Classify every pixel of a BGR image.
+        Returns:
+            np.ndarray: uint8 array of the image's height and width, the index of every pixel's color in names.
+        """
+        channels = cv2.LUT(image, self._index_lut)
+        index = cv2.transform(channels, np.ones((1, 3), np.float32))
+        return self._flat[index]
+
+
+def compile_table(classify):
+    """
+    Build a lookup table from a classifier by classifying the center of every bin.
+    Args:
+        classify (callable): Takes a float array of shape (n, 3) of BGR colors, returns the name index of each.
+    Returns:
+        np.ndarray: The uint8 table of shape (32, 32, 32).
+    """
+    centers = (np.arange(_BINS) << _SHIFT) + (1 << _SHIFT) / 2
+    b, g, r = np.meshgrid(centers, centers, centers, indexing="ij")
+    colors = np.stack([b.ravel(), g.ravel(), r.ravel()], axis=1)
+    return np.asarray(classify(colors), dtype=np.uint8).reshape(_BINS, _BINS, _BINS)
+
+
+def load(path=None):
+    """
+    Load the color lookup table.
+    Returns:
+        ColorLut | None: The table, or None if the file doesn't exist or can't be read.
+    """
+    path = Path(path or settings.COLOR_LUT_FILE)
+    if not path.exists():
+        return None
+
+    try:
+        with np.load(path) as data:
+            return ColorLut(data["table"], data["names"].tolist())
+    except (OSError, KeyError, ValueError) as e:
+        print(f"Error loading the color lookup table from {path}: {e}")
+        return None
+
+
+def save(lut, path=None):
+    """Save a color lookup table."""
+    path = Path(path or settings.COLOR_LUT_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        np.savez_compressed(f, table=lut.table, names=lut.names)
+    print(f"Color lookup table saved to {path}")
+
+
+_lut: ColorLut | None = None
+_loaded = False
+
+
+def get_lut():
+    """
+    Get the calibrated color lookup table (loaded on first use, once per process).
+    Returns:
+        ColorLut | None: The table, or None if the colors have not been calibrated.
+    """
+    global _lut, _loaded
+    if not _loaded:
+        _lut = load()
+        _loaded = True
+        if _lut is not None:
+            print(f"Color lookup table loaded from {settings.COLOR_LUT_FILE}")
+    return _lut
+
+
+def set_lut(lut):
+    """Use lut instead of the calibrated table, None falls back to the HSV ranges."""
+    global _lut, _loaded
+    _lut = lut
+    _loaded = True
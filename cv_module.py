@@ -1,119 +1,772 @@
 import cv2
 import time
-import detect_balls
 import numpy as np
 import eventlet
-import platform
+import eventlet.patcher
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from eventlet import tpool
+from eventlet.event import Event
+from typing import NamedTuple
+from detection_executor import DetectionExecutor
+from ball_tracker import BallTracker
+from frame_sources import FrameSource, get_frame_source
+from stage_timing import collect, stage
+import background_model
+import metrics
+import settings
 
-cap: cv2.VideoCapture | None = None
-_latest_frame: np.ndarray | None = None
+# A real lock, the frame ring is shared by the hub and the capture loop's tpool thread
+_threading = eventlet.patcher.original("threading")
 
-def get_camera():
+_streams: dict[int, "CameraStream"] = {}
+_detector: DetectionExecutor | None = None
+_video_clients = 0  # Numbers the live video clients in the metrics
+
+
+class Frame(NamedTuple):
+    """
+    A single frame published by a CameraStream.
+    seq is a monotonic sequence number (per camera) and timestamp is the capture time (time.time()).
+    In MJPEG pass-through mode image is None and jpeg holds the source's compressed frame,
+    jpeg_flip tells it still has to be mirrored to the app's orientation (see decode_frame()).
+    """
+    seq: int
+    timestamp: float
+    image: np.ndarray | None
+    jpeg: bytes | None = None
+    jpeg_flip: bool = False
+
+
+class EncodeProfile(NamedTuple):
+    """
+    How a frame is turned into JPEG bytes for a viewer.
+    A frame is resized and encoded at most once per profile, see JpegCache.
+    size is the output (width, height), None keeps the camera resolution.
+    max_fps caps how often a live video client is sent a frame.
+    """
+    name: str
+    params: tuple = ()
+    size: tuple[int, int] | None = None
+    max_fps: float = 20
+
+
+# Opimized JPEG encoding parameters, shared by the live video and /get-image
+FULL_PROFILE = EncodeProfile("full", (
+    cv2.IMWRITE_JPEG_QUALITY, 90,          # quality level
+    cv2.IMWRITE_JPEG_PROGRESSIVE, 1,       # progressive loading
+    cv2.IMWRITE_JPEG_OPTIMIZE, 1,          # size optimization
+))
+
+# Live video profiles from best to cheapest. "auto" walks this list based on the client's throughput
+STREAM_PROFILES = {
+    "full": FULL_PROFILE,
+    "medium": EncodeProfile("medium", (cv2.IMWRITE_JPEG_QUALITY, 80), (960, 540), 15),
+    "low": EncodeProfile("low", (cv2.IMWRITE_JPEG_QUALITY, 70), (640, 360), 10),
+}
+
+
+class JpegCache:
     """
-    Initialize the camera if not already done.
+    Encoded frames keyed by (frame seq, profile name).
+    Every viewer asking for the same frame in the same profile gets the same bytes,
+    so the encoding cost no longer grows with the number of viewers.
+    Pass-through frames are served as they are in the full profile and only decoded for the smaller ones.
+    The frame's ring slot (if ring is given) is held while encoding.
+    """
+
+    def __init__(self, max_entries=16, ring: "FrameRing | None" = None):
+        self.max_entries = max_entries
+        self.ring = ring
+        self._entries: OrderedDict[tuple[int, str], bytes] = OrderedDict()
+        self._in_flight: dict[tuple[int, str], Event] = {}
+
+    def get(self, frame, profile=FULL_PROFILE):
+        """
+        Get the JPEG bytes of a frame, encoding it only if no one has done so yet.
+        Returns:
+            bytes | None: The encoded frame, or None if encoding failed or the frame is gone from the ring.
+        """
+        if frame.jpeg is not None and profile.size is None:
+            return frame.jpeg
+
+        key = (frame.seq, profile.name)
+        jpeg = self._entries.get(key)
+        if jpeg is not None:
+            return jpeg
+
+        # Someone is already encoding this frame, share their result
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return in_flight.wait()
+
+        in_flight = self._in_flight[key] = Event()
+        jpeg = None
+        try:
+            with hold_frame(self.ring, frame) as intact:
+                if intact:
+                    # Encoding is a blocking C call, run it on a native thread so the hub keeps serving
+                    jpeg, durations = tpool.execute(_encode, frame.image if frame.jpeg is None else frame.jpeg, profile)
+                    metrics.observe_stages(durations)
+        finally:
+            del self._in_flight[key]
+            in_flight.send(jpeg)
+        if jpeg is None:
+            return None
+
+        self._entries[key] = jpeg
+        # Frames only get newer, so the oldest entries are the ones nobody will ask for again
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return jpeg
+
+
+def _encode(image, profile):
+    """
+    Args:
+        image (np.ndarray | bytes): The frame, or its JPEG in pass-through mode (kept in the camera's orientation).
     Returns:
-        cv2.VideoCapture: The camera object.
+        tuple: (JPEG bytes or None if encoding failed, stage durations of the decode, resize and encode)
+    """
+    with collect() as durations:
+        if isinstance(image, bytes):
+            with stage("decode"):
+                image = _decode_jpeg(image, profile.size)
+            if image is None:
+                return None, durations
+        if profile.size is not None and image.shape[1::-1] != profile.size:
+            with stage("resize"):
+                image = cv2.resize(image, profile.size, interpolation=cv2.INTER_AREA)
+
+        with stage("encode"):
+            ret, buffer = cv2.imencode('.jpg', image, list(profile.params))
+    if not ret:
+        return None, durations
+    return buffer.tobytes(), durations
+
+
+# libjpeg decodes at 1/2, 1/4 or 1/8 scale for a fraction of the full decode's cost
+_REDUCED_DECODE_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+
+
+def _jpeg_size(jpeg):
     """
-    global cap
-    if cap is None or not cap.isOpened():
-        system = platform.system()
+    Returns:
+        tuple | None: (width, height) from the JPEG's frame header, None if there is none.
+    """
+    # Start of frame markers, baseline / extended / progressive
+    for marker in (b"\xff\xc0", b"\xff\xc1", b"\xff\xc2"):
+        index = jpeg.find(marker)
+        if index >= 0 and index + 9 <= len(jpeg):
+            return int.from_bytes(jpeg[index + 7 : index + 9], "big"), int.from_bytes(jpeg[index + 5 : index + 7], "big")
+    return None
+
+
+def _decode_jpeg(jpeg, size=None):
+    """
+    Decode a JPEG, at the smallest reduced scale that is still at least size (width, height) if given.
+    Returns:
+        np.ndarray | None: The image, or None if the JPEG can't be decoded.
+    """
+    flags = cv2.IMREAD_COLOR
+    jpeg_size = _jpeg_size(jpeg) if size is not None else None
+    if jpeg_size is not None:
+        for factor, reduced_flags in _REDUCED_DECODE_FLAGS.items():
+            if jpeg_size[0] // factor >= size[0] and jpeg_size[1] // factor >= size[1]:
+                flags = reduced_flags
+                break
+    return cv2.imdecode(np.frombuffer(jpeg, np.uint8), flags)
+
+
+def decode_frame(frame):
+    """
+    Get the pixels of a frame in the app's orientation, decoding (and mirroring) pass-through JPEGs.
+    Blocking, call it off the hub.
+    Returns:
+        np.ndarray | None: The image, or None if the JPEG can't be decoded.
+    """
+    if frame.jpeg is None:
+        return frame.image
+    image = _decode_jpeg(frame.jpeg)
+    if image is not None and frame.jpeg_flip:
+        cv2.flip(image, 1, dst=image)
+    return image
+
+
+def _read_only(image):
+    """A read-only view of image. Published frames are shared by every consumer, nobody may draw on them."""
+    view = image.view()
+    view.flags.writeable = False
+    return view
+
+
+class FrameRing:
+    """
+    The last `capacity` frames of a stream in one preallocated block of memory, reused in place.
+    The frame with seq n lives in slot n % capacity until the frame capacity seqs later overwrites it,
+    so a frame can be looked up by seq or capture time for as long as it is in the ring
+    (the exact frame of a button press, short replays) without another camera read.
+    The frame source writes every frame straight into its slot, frames are handed out as read-only views.
+    A slot that is being read on another thread (encoded, copied to a detection worker) is held with hold(),
+    the frame due in it is then captured into a buffer of its own and not kept in the ring.
+    In MJPEG pass-through mode the ring keeps the frames' JPEGs instead.
+    """
+
+    def __init__(self, capacity=90):
+        self.capacity = capacity
+        self._block: np.ndarray | None = None
+        self._seqs = np.full(capacity, -1, dtype=np.int64)
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._jpegs: list[tuple[bytes, bool] | None] = [None] * capacity
+        self._holds = np.zeros(capacity, dtype=np.int64)
+        self._lock = _threading.Lock()
+
+    @property
+    def shape(self):
+        """Shape of the frames in the ring, None before the first frame."""
+        return None if self._block is None else self._block.shape[1:]
+
+    def slot(self, seq, shape):
+        """
+        The slot to capture the frame with the given seq into.
+        The block is allocated for the first frame and again (forgetting all frames) if the resolution changes.
+        Returns:
+            np.ndarray: Writable image of the given shape, a new array if the slot is held.
+        """
+        with self._lock:
+            if self._block is None or self._block.shape[1:] != shape:
+                print(f"Allocating a frame ring of {self.capacity} frames of {shape}")
+                self._seqs = np.full(self.capacity, -1, dtype=np.int64)
+                self._block = np.empty((self.capacity, *shape), dtype=np.uint8)
+            index = seq % self.capacity
+            if self._holds[index]:
+                return np.empty(shape, dtype=np.uint8)
+            # Until add() the slot holds neither the old frame nor the new one
+            self._seqs[index] = -1
+        return self._block[index]
+
+    def _in_ring(self, frame):
+        return frame.jpeg is None and self._block is not None and np.may_share_memory(frame.image, self._block)
+
+    def add(self, frame):
+        """Record that frame (whose image is its slot, or a pass-through JPEG) has been captured."""
+        if frame.jpeg is None and not self._in_ring(frame):
+            # Captured outside the ring, its slot was held
+            return
+        index = frame.seq % self.capacity
+        self._timestamps[index] = frame.timestamp
+        self._jpegs[index] = (frame.jpeg, frame.jpeg_flip) if frame.jpeg is not None else None
+        self._seqs[index] = frame.seq
+
+    def holds(self, seq):
+        """
+        Returns:
+            bool: True if the frame with the given seq is (still) in the ring.
+        """
+        return seq >= 0 and self._seqs[seq % self.capacity] == seq
+
+    @contextmanager
+    def hold(self, frame):
+        """
+        Keep the capture loop from reusing the slot of a frame while its image is read.
+        Yields:
+            bool: False if the slot has been reused already, the image is (partly) a later frame.
+        """
+        index = frame.seq % self.capacity
+        with self._lock:
+            in_ring = self._in_ring(frame)
+            intact = not in_ring or self._seqs[index] == frame.seq
+            if in_ring and intact:
+                self._holds[index] += 1
+        try:
+            yield intact
+        finally:
+            if in_ring and intact:
+                with self._lock:
+                    self._holds[index] -= 1
+
+    def nearest(self, seq=None, timestamp=None):
+        """
+        Find the frame closest to a seq or, without one, to a capture time (time.time()).
+        Returns:
+            Frame | None: The frame, its image a view into the ring, or None if the ring is empty.
+        """
+        valid = np.flatnonzero(self._seqs >= 0)
+        if len(valid) == 0:
+            return None
+        if seq is not None:
+            index = valid[np.argmin(np.abs(self._seqs[valid] - seq))]
+        else:
+            index = valid[np.argmin(np.abs(self._timestamps[valid] - timestamp))]
+
+        seq, timestamp = int(self._seqs[index]), float(self._timestamps[index])
+        if self._jpegs[index] is not None:
+            return Frame(seq, timestamp, None, *self._jpegs[index])
+        return Frame(seq, timestamp, _read_only(self._block[index]))
+
+
+def hold_frame(ring, frame):
+    """
+    ring.hold(frame), or nothing to hold without a ring.
+    Yields:
+        bool: False if the frame's slot has been reused already.
+    """
+    return ring.hold(frame) if ring is not None else nullcontext(True)
+
+
+def _read(source, ring, seq):
+    """
+    Read a frame on a tpool thread into its ring slot.
+    Returns:
+        tuple: (read-only view of the slot or None if no frame was read, capture time, stage durations of the read (and flip))
+    """
+    with collect() as durations:
+        slot = ring.slot(seq, ring.shape) if ring.shape is not None else None
+        image = source.read(slot)
+        timestamp = time.time()
+        if image is None:
+            return None, timestamp, durations
+        if image is not slot:
+            # First frame, or the resolution changed: (re)allocate the ring and copy this one frame in
+            with stage("ring_copy"):
+                slot = ring.slot(seq, image.shape)
+                slot[:] = image
+    return _read_only(slot), timestamp, durations
+
+
+def _read_jpeg(source):
+    """
+    Read a pass-through JPEG on a tpool thread.
+    Returns:
+        tuple: (JPEG bytes or None if no frame was read, capture time, stage durations of the read)
+    """
+    with collect() as durations:
+        jpeg = source.read_jpeg()
+        timestamp = time.time()
+    return jpeg, timestamp, durations
+
+
+class CameraStream:
+    """
+    Runs the one and only capture loop for a camera.
+    The loop owns the frame source (the camera, or a replay / synthetic source, see frame_sources.py)
+    and publishes every frame with a sequence number and timestamp. Any number of consumers (MJPEG clients,
+    get_picture(), detection) subscribe with wait_for_frame() / latest() and never touch the device themselves.
+    The last few seconds of frames stay available in a FrameRing; a published frame's image is its ring slot.
+    """
+
+    def __init__(self, camera_index=0, source: FrameSource | None = None):
+        self.camera_index = camera_index
+        self.source = source or get_frame_source(camera_index)
+        self.ring = FrameRing(settings.FRAME_RING_FRAMES)
+        self._latest: Frame | None = None
+        self._new_frame = Event()
+        self._seq = 0
+        self._loop = None
+        self._fps: float | None = None
+        self.jpeg_cache = JpegCache(ring=self.ring)
 
-        print("Waiting for camera to be available...")
-        cap = cv2.VideoCapture(0, cv2.CAP_DSHOW) if system == "Windows" else cv2.VideoCapture(0)
+    def start(self):
+        """Start the capture loop if it is not running yet."""
+        if self._loop is None or self._loop.dead:
+            self._loop = eventlet.spawn(self._capture_loop)
 
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    def latest(self):
+        """
+        Returns:
+            Frame | None: The newest published frame, or None if nothing has been captured yet.
+        """
+        return self._latest
 
-        if not cap.isOpened():
-            print("❌ Failed to open camera.")
-            exit()
-        if cap.isOpened():
-            print("Camera initialized successfully")
+    def wait_for_frame(self, after_seq=-1, timeout=None):
+        """
+        Wait until a frame newer than after_seq is available.
+        Frames in between are skipped, a consumer always gets the newest one.
+        Args:
+            after_seq (int): Sequence number of the last frame the caller has seen.
+            timeout (float | None): Seconds to wait before giving up.
+        Returns:
+            Frame | None: The newest frame, or None on timeout.
+        """
+        self.start()
+        frame = self._latest
+        if frame is not None and frame.seq > after_seq:
+            return frame
+        return self._new_frame.wait(timeout)
 
-    return cap
+    @property
+    def client_mirror(self):
+        """
+        True if the newest frame is the camera's own, unmirrored JPEG (MJPEG pass-through) that the client
+        has to mirror. It changes when a camera falls back from pass-through to decoding, so it is per frame.
+        """
+        frame = self._latest
+        return frame is not None and frame.jpeg_flip
+
+    def _publish(self, image, timestamp, jpeg=None):
+        self._seq += 1
+        frame = Frame(self._seq, timestamp, image, jpeg, jpeg is not None and self.source.jpeg_needs_flip)
+        self.ring.add(frame)
+        if self._latest is not None:
+            interval = frame.timestamp - self._latest.timestamp
+            if interval > 0:
+                self._fps = 1 / interval if self._fps is None else 0.9 * self._fps + 0.1 / interval
+                metrics.capture_fps.set(round(self._fps, 2))
+        self._latest = frame
+        metrics.frames_captured.inc()
+
+        # Wake up everyone waiting for this frame and arm a fresh event for the next one
+        event, self._new_frame = self._new_frame, Event()
+        event.send(frame)
+
+    def _capture_loop(self):
+        while True:
+            # Opening and reading the camera are blocking C calls that monkey patching can't make
+            # cooperative, so they run on a native thread and the hub keeps serving everyone else
+            if self.source.jpeg_passthrough:
+                image = None
+                jpeg, timestamp, durations = tpool.execute(_read_jpeg, self.source)
+            else:
+                jpeg = None
+                image, timestamp, durations = tpool.execute(_read, self.source, self.ring, self._seq + 1)
+            metrics.observe_stages(durations)
+            if image is None and jpeg is None:
+                metrics.capture_errors.inc()
+                print("Can't receive frame (stream end?). Retrying ...")
+                eventlet.sleep(0.5)
+                continue
+
+            self._publish(image, timestamp, jpeg)
+
+
+def get_stream(camera_index=0):
+    """
+    Get the (started) CameraStream for a camera, creating it on first use.
+    Returns:
+        CameraStream: The shared stream of the camera.
+    """
+    stream = _streams.get(camera_index)
+    if stream is None:
+        stream = CameraStream(camera_index)
+        _streams[camera_index] = stream
+    stream.start()
+    return stream
 
 
 def get_picture():
     """
-    Capture a picture from the camera.
+    Capture a picture from the camera, in the app's (mirrored) orientation also in MJPEG pass-through mode.
     Returns:
         bytes: The captured image as bytes.
-        np.ndarray: The captured image as a NumPy array.
     """
-    global _latest_frame
-
-    camera = get_camera()
-    if not camera.isOpened():
-        print("Camera not available")
+    picture = get_picture_at()
+    if picture is None:
         return None
 
-    # time.sleep(0.5)
-    ret, frame = camera.read()
-    if not ret:
-        print("Cap is not returning a frame")
-        return None
-    
-    flip = cv2.flip(frame, 1)
-    _latest_frame = flip.copy()  # Store the latest frame for further processing
+    frame, image_bytes = picture
+    if frame.jpeg_flip:
+        # Viewers mirror pass-through JPEGs themselves, a saved picture has to be mirrored here
+        image_bytes = tpool.execute(_encode_mirrored, frame)
+    return image_bytes
 
-    ret, buffer = cv2.imencode('.jpg', flip)
-    if not ret:
-        print("Flip is not returning buffer")
+
+def _encode_mirrored(frame):
+    image = decode_frame(frame)
+    if image is None:
         return None
-    
-    return buffer.tobytes()
+    jpeg, _ = _encode(image, FULL_PROFILE)
+    return jpeg
 
 
-def get_live_video():
+def get_picture_at(seq=None, timestamp=None):
+    """
+    Get the frame nearest to a frame seq or capture time from the frame ring, e.g. the frame the
+    player saw when pressing Capture. No camera read is involved, the frame was captured already.
+    Args:
+        seq (int | None): Frame seq to look for.
+        timestamp (float | None): Capture time (time.time()) to look for, used if seq is None.
+            Without either, the newest frame (waiting for the first one if needed).
+    Returns:
+        tuple | None: (Frame, JPEG bytes), or None if there is no frame or it could not be encoded.
+    """
+    stream = get_stream()
+    # The oldest frame in the ring is the next one to be overwritten, if that happens before its slot is held
+    # for encoding the nearest frame is looked up again (the one after it, still close to what was asked for)
+    for _ in range(2):
+        if seq is None and timestamp is None:
+            frame = stream.wait_for_frame(timeout=5)
+        else:
+            frame = stream.ring.nearest(seq, timestamp)
+        if frame is None:
+            print("Camera is not returning a frame")
+            return None
+
+        image_bytes = stream.jpeg_cache.get(frame)
+        if image_bytes is not None:
+            return frame, image_bytes
+        if stream.ring.holds(frame.seq):
+            return None
+
+    print(f"Frame {frame.seq} was overwritten before encoding it from the frame ring")
+    return None
+
+
+class AdaptiveProfile:
+    """
+    Picks the live video profile for one client from how long its sends take.
+    A send that takes longer than the profile's frame interval means the client can't keep up,
+    so we step down right away. We step back up only after the client has been comfortably
+    fast for a few seconds, so the profile doesn't flap on a noisy Wi-Fi link.
+    """
+
+    def __init__(self, profiles=tuple(STREAM_PROFILES.values())):
+        self.profiles = profiles
+        self.index = 0
+        self._send_time: float | None = None
+        self._fast_sends = 0
+
+    @property
+    def profile(self):
+        return self.profiles[self.index]
+
+    def record_send(self, seconds):
+        """
+        Record how long sending the last frame took and switch profile if needed.
+        Args:
+            seconds (float): Time the client took to accept the frame.
+        """
+        interval = 1 / self.profile.max_fps
+        if self._send_time is None:
+            self._send_time = seconds
+        else:
+            self._send_time = 0.8 * self._send_time + 0.2 * seconds
+
+        if self._send_time > interval and self.index < len(self.profiles) - 1:
+            self._switch(self.index + 1)
+        elif self._send_time < interval / 4:
+            self._fast_sends += 1
+            if self._fast_sends >= self.profile.max_fps * 5 and self.index > 0:
+                self._switch(self.index - 1)
+        else:
+            self._fast_sends = 0
+
+    def _switch(self, index):
+        print(f"Live video profile {self.profile.name} -> {self.profiles[index].name}")
+        self.index = index
+        self._send_time = None
+        self._fast_sends = 0
+
+
+def get_live_video(profile="auto"):
     """
     Generator function to yield frames from the camera as a live video stream.
+    Slow clients never get a backlog: every send picks the newest frame and the ones
+    published in the meantime are dropped for that client.
+    Args:
+        profile (str): Name of a profile in STREAM_PROFILES, or "auto" to pick one from the client's throughput.
     Yields:
         bytes: The current frame as bytes.
     """
-    global _latest_frame
+    adaptive = AdaptiveProfile() if profile == "auto" else None
+    fixed_profile = STREAM_PROFILES.get(profile)
+    if adaptive is None and fixed_profile is None:
+        print(f"Unknown live video profile: {profile}")
+        return None
+
+    return _live_video_frames(get_stream(), adaptive, fixed_profile)
+
+
+def _live_video_frames(stream, adaptive, fixed_profile):
+    global _video_clients
+    _video_clients += 1
+    client = f"video-{_video_clients}"
+    metrics.mjpeg_clients.inc()
+    try:
+        yield from _send_live_video(stream, adaptive, fixed_profile, client)
+    finally:
+        # Also runs when the client disconnects and the server closes the generator
+        metrics.mjpeg_clients.dec()
+        metrics.bytes_sent.remove(client=client)
+
 
-    camera = get_camera()
-    if not camera.isOpened():
-        print("Cannot open camera")
-        return
+def _send_live_video(stream, adaptive, fixed_profile, client):
+    last_seq = -1
+    last_sent = 0.0
 
     while True:
-        ret, frame = camera.read()
-        if not ret:
+        current_profile = adaptive.profile if adaptive else fixed_profile
+
+        # Respect the profile's frame rate cap
+        wait = last_sent + 1 / current_profile.max_fps - time.monotonic()
+        if wait > 0:
+            eventlet.sleep(wait)
+
+        frame = stream.wait_for_frame(last_seq, timeout=5)
+        if frame is None:
             print("Can't receive frame (stream end?). Exiting ...")
             break
-        
-        flip = cv2.flip(frame, 1)
-        _latest_frame = flip.copy()
-
-        # Opimize JPEG encoding parameters
-        encode_params = [
-            cv2.IMWRITE_JPEG_QUALITY, 90,          # quality level
-            cv2.IMWRITE_JPEG_PROGRESSIVE, 1,       # progressive loading
-            cv2.IMWRITE_JPEG_OPTIMIZE, 1           # size optimization
-        ]
-
-        ret, buffer = cv2.imencode('.jpg', flip, encode_params)
-        if not ret:
+        if last_seq >= 0 and frame.seq > last_seq + 1:
+            metrics.frames_dropped.inc(frame.seq - last_seq - 1, consumer="video")
+        last_seq = frame.seq
+
+        frame_bytes = stream.jpeg_cache.get(frame, current_profile)
+        if frame_bytes is None:
             continue
 
-        frame_bytes = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        eventlet.sleep(0.05)
+        # The server resumes us once the client has accepted the chunk, so this measures the send
+        last_sent = time.monotonic()
+        chunk = (b'--frame\r\n'
+                 b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+        yield chunk
+        metrics.bytes_sent.inc(len(chunk), client=client)
+        if adaptive:
+            adaptive.record_send(time.monotonic() - last_sent)
 
 
-def get_empty_table():
-    # Placeholder for empty table retrieval logic
-    return "Empty table data"
+def get_empty_table(frames=None):
+    """
+    Capture the empty table as the background model of detection (background_model.py): the median of
+    the next frames, saved to BACKGROUND_FILE where the detection workers pick it up.
+    Args:
+        frames (int | None): Number of frames, BACKGROUND_FRAMES by default.
+    Returns:
+        bytes | None: The empty table as JPEG, or None if the camera delivers no frames.
+    """
+    stream = get_stream()
+    images = []
+    seq = -1
+    while len(images) < (frames or settings.BACKGROUND_FRAMES):
+        frame = stream.wait_for_frame(seq, timeout=5)
+        if frame is None:
+            print("Error capturing the empty table: no frames from the camera")
+            return None
+        seq = frame.seq
+        with stream.ring.hold(frame) as intact:
+            image = tpool.execute(_copy_frame, frame) if intact else None
+        if image is not None:
+            images.append(image)
+
+    image = tpool.execute(background_model.build, images)
+    tpool.execute(background_model.save, image)
+    jpeg, _ = tpool.execute(_encode, image, FULL_PROFILE)
+    return jpeg
+
+
+def _copy_frame(frame):
+    """The pixels of a frame in a new array, a ring slot is reused by later frames once it is no longer held."""
+    image = decode_frame(frame)
+    if image is None or frame.jpeg is not None:
+        return image
+    return image.copy()
+
+
+class DetectionScheduler:
+    """
+    Drives ball detection from the frames of a camera stream.
+    Every new frame seq is submitted once; while detection is behind, only the newest frame waits
+    for a worker and the older ones are skipped, so results never queue up. Any number of callers
+    asking for positions at the same time share the one result for the newest frame.
+    """
+
+    def __init__(self, stream, executor):
+        self.stream = stream
+        self.executor = executor
+        self._loop = None
+
+    def start(self):
+        """Start submitting every new frame of the stream for detection."""
+        if self._loop is None or self._loop.dead:
+            self._loop = eventlet.spawn(self._schedule_loop)
+
+    def stop(self):
+        """Stop submitting new frames, e.g. when nobody is watching. get_positions() still works."""
+        if self._loop is not None:
+            self._loop.kill()
+            self._loop = None
+
+    @property
+    def running(self):
+        return self._loop is not None and not self._loop.dead
+
+    def get_positions(self, timeout=2):
+        """
+        Get the ball positions of the newest frame, waiting for them if they are not ready yet.
+        Returns:
+            DetectionResult | None: The result, or None if no frame or result is available in time.
+        """
+        frame = self.stream.latest()
+        if frame is None:
+            return None
+
+        # No-op if the scheduling loop (or another caller) already submitted this frame
+        self.executor.submit(frame)
+        return self.executor.wait_for_result(frame.seq, timeout)
+
+    def _schedule_loop(self):
+        last_seq = -1
+        while True:
+            frame = self.stream.wait_for_frame(last_seq, timeout=5)
+            if frame is None:
+                continue
+            if last_seq >= 0 and frame.seq > last_seq + 1:
+                metrics.frames_dropped.inc(frame.seq - last_seq - 1, consumer="detection")
+            last_seq = frame.seq
+            self.executor.submit(frame)
+
+
+_scheduler: DetectionScheduler | None = None
+
 
+def get_detector():
+    """
+    Get the (started) process pool that runs ball detection.
+    Returns:
+        DetectionExecutor: The shared detection executor.
+    """
+    global _detector
+    if _detector is None:
+        tracker = BallTracker(settings.TRACKER_FULL_DETECTION_INTERVAL) if settings.TRACKING else None
+        _detector = DetectionExecutor(settings.DETECTION_WORKERS, tracker, get_stream().ring)
+    _detector.start()
+    return _detector
+
+
+def get_detection_scheduler():
+    """
+    Get the scheduler that feeds the detector from the default camera stream.
+    Call start() on it to run detection on every new frame, results go to the detector's listeners.
+    Returns:
+        DetectionScheduler: The shared detection scheduler.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = DetectionScheduler(get_stream(), get_detector())
+    return _scheduler
 
-############### WIP ###############
-def get_ball_positions():
-    if _latest_frame is not None:
-        latest_positions = detect_balls.get_ball_positions(_latest_frame)
-        return latest_positions
-    else:
+
+def positions_with_table_coords(result):
+    """
+    Flatten a DetectionResult into one tuple per ball.
+    Returns:
+        list: (x, y, color) tuples, or (x, y, color, table_x, table_y) if the table corners are calibrated.
+    """
+    if result.table_positions is None:
+        return list(result.positions)
+    return [(x, y, color, tx, ty) for (x, y, color), (tx, ty) in zip(result.positions, result.table_positions)]
+
+
+def get_ball_positions(timeout=2):
+    """
+    Get the ball positions of the newest frame.
+    Returns:
+        list | None: List of (x, y, color) tuples (see positions_with_table_coords), or None if no frame or result is available.
+    """
+    if get_stream().latest() is None:
         print("No frame available to get ball positions")
         return None
-############### WIP ###############
+
+    result = get_detection_scheduler().get_positions(timeout)
+    if result is None:
+        print("Ball detection timed out")
+        return None
+    return positions_with_table_coords(result)
@@ -1,74 +1,417 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
+import background_model
+import color_model
+import detector_params
+import settings
+import stage_timing
+import table_calibration
+from stage_timing import stage
 
 
 def get_ball_positions(frame):
     """
-    Detect centers of balls in the frame using HoughCircles
-    Returns list of (x, y, color) tuples
+    Detect centers of balls in the frame using HoughCircles (or the empty table, see DETECTION_MODE).
+    If the table is calibrated, only the table bed (cropped or rectified) is searched.
+    Returns list of (x, y, color) tuples in frame pixels
+    """
+    calibration = table_calibration.get_calibration()
+    if calibration is not None:
+        with stage("rectify"):
+            dst = _buffer("rectified", (*calibration.rectified_size[::-1], frame.shape[2])) if calibration.rectifies else None
+            table = calibration.detection_image(frame, dst)
+        balls = _get_ball_positions(table)
+        centers = calibration.to_frame_coords([(x, y) for x, y, _ in balls])
+        return [(x, y, color) for (x, y), (_, _, color) in zip(centers, balls)]
+
+    return _get_ball_positions(frame)
+
+
+# HoughCircles parameters of get_ball_positions, in full resolution pixels
+HOUGH_PARAMS = {
+    "dp": 1.5,  # Inverse ratio of the accumulator resolution to the image resolution
+    "minDist": 20,  # Minimum distance between the centers of the detected circles
+    "param1": 200,  # Higher threshold for the internal Canny edge detector
+    "param2": 0.9,  # Accumulator threshold for the circle centers (0.0-1.0 for ALT version)
+    "minRadius": 20,  # Minimum circle radius to be detected
+    "maxRadius": 30,  # Maximum circle radius to be detected
+}
+
+# Contrast (alpha), brightness (beta) and Gaussian blur of the image HoughCircles runs on
+PREPROCESS_PARAMS = {
+    "alpha": 1.4,
+    "beta": 10,
+    "blur_sigma": 3,
+}
+
+# Values tuned for the hall's lighting (tune_detector.py) override the defaults above
+HOUGH_PARAMS.update(detector_params.get("detect_balls", "hough") or {})
+PREPROCESS_PARAMS.update(detector_params.get("detect_balls", "preprocess") or {})
+
+
+# Output buffers of the preprocessing steps, per thread and image shape, reused for every frame.
+# Windows at the frame edges come in many shapes, so the cache is dropped when it grows past _MAX_BUFFERS.
+_buffers = threading.local()
+_MAX_BUFFERS = 32
+
+
+def _buffer(name, shape, dtype=np.uint8):
+    """
+    Get the reusable buffer of a preprocessing step. Its content is overwritten by the next frame of this thread.
+    Returns:
+        np.ndarray: Uninitialized array of the given shape.
+    """
+    arrays = getattr(_buffers, "arrays", None)
+    if arrays is None:
+        arrays = _buffers.arrays = {}
+    key = (name, tuple(shape), dtype)
+    array = arrays.get(key)
+    if array is None:
+        if len(arrays) >= _MAX_BUFFERS:
+            arrays.clear()
+        array = arrays[key] = np.empty(shape, dtype)
+    return array
+
+
+def _get_ball_positions(frame):
+    model = _background() if settings.DETECTION_MODE == "background" else None
+    if settings.DETECTION_MODE == "pyramid":
+        circles = _find_circles_pyramid(frame, settings.PYRAMID_SCALE)
+    elif settings.DETECTION_MODE == "tiled":
+        circles = _find_circles_tiled(frame, settings.DETECTION_TILES)
+    elif model is not None:
+        circles, foreground = _find_circles_background(frame, model)
+        with stage("background_refresh"):
+            model.refresh(frame, foreground)
+    else:
+        circles = _find_circles(_preprocess(frame))
+
+    ball_centers = []
+    for x, y, r in np.round(circles).astype("int"):
+        ball_centers.append((x, y, 25))
+
+    balls_with_color = detect_color_from_balls(ball_centers, frame)
+
+    return balls_with_color
+
+
+def _preprocess(image):
     """
+    Grayscale, contrast and blur the image for HoughCircles.
+    Returns:
+        np.ndarray: The blurred image, in a buffer that the next call for the same shape reuses.
+    """
+    shape = image.shape[:2]
     # Convert to grayscale
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    with stage("color_convert"):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=_buffer("gray", shape))
 
-    # Adjust brightness and contrast
-    adjusted_gray = cv2.convertScaleAbs(gray, alpha=1.4, beta=10)
+    with stage("blur"):
+        # Adjust brightness and contrast, in place
+        cv2.convertScaleAbs(gray, dst=gray, alpha=PREPROCESS_PARAMS["alpha"], beta=PREPROCESS_PARAMS["beta"])
 
-    # Apply Gaussian blur to reduce noise
-    blurred = cv2.GaussianBlur(adjusted_gray, (3, 3), 3)
+        # Apply Gaussian blur to reduce noise
+        return cv2.GaussianBlur(gray, (3, 3), PREPROCESS_PARAMS["blur_sigma"], dst=_buffer("blurred", shape))
 
-    # Use HoughCircles to detect circular objects
-    circles = cv2.HoughCircles(
-        blurred,
-        cv2.HOUGH_GRADIENT_ALT,  # Alternative Hough gradient method - more accurate
-        dp=1.5,  # Inverse ratio of the accumulator resolution to the image resolution
-        minDist=20,  # Minimum distance between the centers of the detected circles
-        param1=200,  # Higher threshold for the internal Canny edge detector
-        param2=0.9,  # Accumulator threshold for the circle centers (0.0-1.0 for ALT version)
-        minRadius=20,  # Minimum circle radius to be detected
-        maxRadius=30,  # Maximum circle radius to be detected
-    )
 
-    ball_centers = []
-    if circles is not None:
-        circles = np.round(circles[0, :]).astype("int")
-        for x, y, r in circles:
-            ball_centers.append((x, y, 25))
+def _find_circles(blurred, scale=1.0, **overrides):
+    """
+    Run HoughCircles with HOUGH_PARAMS scaled to an image that is scale times the full resolution.
+    Returns:
+        np.ndarray: Array of shape (n, 3) with (x, y, r) of every circle, in the image's pixels.
+    """
+    params = dict(HOUGH_PARAMS, **overrides)
+    with stage("hough"):
+        circles = cv2.HoughCircles(
+            blurred,
+            cv2.HOUGH_GRADIENT_ALT,  # Alternative Hough gradient method - more accurate
+            dp=params["dp"],
+            minDist=params["minDist"] * scale,
+            param1=params["param1"],
+            param2=params["param2"],
+            minRadius=max(1, int(params["minRadius"] * scale)),
+            maxRadius=int(np.ceil(params["maxRadius"] * scale)),
+        )
+    if circles is None:
+        return np.empty((0, 3), np.float32)
+    return circles[0]
 
-    balls_with_color = detect_color_from_balls(ball_centers, frame)
 
-    return balls_with_color
+_warned_no_background = False
+
+
+def _background():
+    """
+    Returns:
+        background_model.BackgroundModel | None: The empty table model, None (and a warning once) if none was captured.
+    """
+    global _warned_no_background
+    model = background_model.get_model()
+    if model is None and not _warned_no_background:
+        print("No background model (POST /capture-table on the empty table), detecting with HoughCircles")
+        _warned_no_background = True
+    return model
+
+
+# Opening of the foreground mask, removes single noisy pixels and thin lines (cloth texture, cushion edges)
+_OPEN_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+# The background model whose size didn't match the frames, warned about once (and again for a new model)
+_warned_shape_model = None
+
+
+def _find_circles_background(frame, model):
+    """
+    Find the balls by differencing with the empty table: pixels that differ more than BACKGROUND_THRESHOLD
+    in any channel are foreground, and every connected component of the size of one ball is a ball,
+    centered on its centroid. Only larger components (touching balls, a cluster of reds) go through
+    HoughCircles, in their bounding box. Components smaller than half a ball are noise.
+    Returns:
+        tuple: (circles, foreground). circles is an array of shape (n, 3) with (x, y, r) of every ball,
+            foreground the uint8 mask of everything that differs from the background (reused by the next frame).
+    """
+    global _warned_shape_model
+    shape = frame.shape[:2]
+    if model.image.shape != frame.shape:
+        if model is not _warned_shape_model:
+            print(f"Background model is {model.image.shape[1]}x{model.image.shape[0]}, the frame {shape[1]}x{shape[0]}, capture the empty table again")
+            _warned_shape_model = model
+        return _find_circles(_preprocess(frame)), np.zeros(shape, np.uint8)
+
+    with stage("background_diff"):
+        diff = cv2.absdiff(frame, model.image, dst=_buffer("diff", frame.shape))
+        # Threshold every channel, then any channel at 255 leaves a nonzero gray pixel (much faster than a max over the channels)
+        cv2.threshold(diff, settings.BACKGROUND_THRESHOLD, 255, cv2.THRESH_BINARY, dst=diff)
+        foreground = cv2.cvtColor(diff, cv2.COLOR_BGR2GRAY, dst=_buffer("foreground", shape))
+        cv2.threshold(foreground, 0, 255, cv2.THRESH_BINARY, dst=foreground)
+        cv2.morphologyEx(foreground, cv2.MORPH_OPEN, _OPEN_KERNEL, dst=foreground)
+
+    with stage("components"):
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            foreground, labels=_buffer("labels", shape, np.int32), connectivity=8, ltype=cv2.CV_32S
+        )
+
+    min_radius, max_radius = HOUGH_PARAMS["minRadius"], HOUGH_PARAMS["maxRadius"]
+    min_area = 0.5 * np.pi * min_radius ** 2
+    max_area = 1.3 * np.pi * max_radius ** 2  # A ball with its shadow
+    max_size = 2 * max_radius + 6
+
+    circles = []
+    for label in range(1, count):
+        x, y, w, h, area = stats[label]
+        if area < min_area:
+            continue
+        if area <= max_area and w <= max_size and h <= max_size:
+            cx, cy = centroids[label]
+            circles.append((cx, cy, np.sqrt(area / np.pi)))
+            continue
+
+        # Touching balls: HoughCircles in the component's box, keeping the circles centered on the component
+        x1, y1 = max(x - 2, 0), max(y - 2, 0)
+        x2, y2 = min(x + w + 2, shape[1]), min(y + h + 2, shape[0])
+        for cx, cy, r in _find_circles(_preprocess(frame[y1:y2, x1:x2])):
+            cx, cy = cx + x1, cy + y1
+            if labels[int(cy), int(cx)] == label:
+                circles.append((cx, cy, r))
+
+    return np.array(circles, np.float32).reshape(-1, 3), foreground
+
+
+def _find_circles_pyramid(frame, scale):
+    """
+    Coarse-to-fine HoughCircles: find candidates on a downscaled frame, then refine every
+    candidate in a small full resolution window around it. Candidates not confirmed there are dropped.
+    Returns:
+        np.ndarray: Array of shape (n, 3) with (x, y, r) of every circle, in full resolution pixels.
+    """
+    with stage("resize"):
+        h, w = frame.shape[:2]
+        size = (int(round(w * scale)), int(round(h * scale)))
+        small = cv2.resize(frame, size, dst=_buffer("small", (size[1], size[0], frame.shape[2])), interpolation=cv2.INTER_AREA)
+    min_radius = max(1, int(HOUGH_PARAMS["minRadius"] * scale))
+    # HOUGH_GRADIENT_ALT misses most circles with a radius of only a few pixels, so the coarse pass uses
+    # the classic method with a loose vote threshold (~30% of the smallest circumference).
+    # Every candidate is verified with the full resolution parameters in its window anyway.
+    blurred = _preprocess(small)
+    with stage("hough"):
+        candidates = cv2.HoughCircles(
+            blurred,
+            cv2.HOUGH_GRADIENT,
+            dp=1,
+            minDist=HOUGH_PARAMS["minDist"] * scale,
+            param1=HOUGH_PARAMS["param1"] / 2,
+            param2=max(5, int(0.3 * 2 * np.pi * min_radius)),
+            minRadius=min_radius,
+            maxRadius=int(np.ceil(HOUGH_PARAMS["maxRadius"] * scale)),
+        )
+    candidates = np.empty((0, 3)) if candidates is None else candidates[0] / scale
+
+    error = 2 / scale  # Position error of the coarse pass
+    refined = []
+    for x, y, _ in candidates:
+        circle = _find_circle_near(frame, x, y, error)
+        if circle is not None:
+            refined.append(circle)
+
+    return np.array(refined, np.float32).reshape(-1, 3)
+
+
+_tile_pool: ThreadPoolExecutor | None = None
+
 
+def _get_tile_pool():
+    global _tile_pool
+    if _tile_pool is None:
+        _tile_pool = ThreadPoolExecutor(settings.DETECTION_THREADS, thread_name_prefix="detect-tile")
+    return _tile_pool
 
-def test_get_ball_positions(frame):
+
+def _tile_bounds(w, h, tiles):
+    """
+    Split a w x h image into columns x rows tiles, each grown by a ball radius (plus a margin) into its
+    neighbours, so every ball lies whole inside the tile its center is in.
+    Returns:
+        list: (x1, y1, x2, y2) of every tile.
+    """
+    columns, rows = tiles
+    overlap = int(HOUGH_PARAMS["maxRadius"]) + 4
+    xs = np.linspace(0, w, columns + 1).astype(int)
+    ys = np.linspace(0, h, rows + 1).astype(int)
+    return [
+        (max(x1 - overlap, 0), max(y1 - overlap, 0), min(x2 + overlap, w), min(y2 + overlap, h))
+        for y1, y2 in zip(ys, ys[1:])
+        for x1, x2 in zip(xs, xs[1:])
+    ]
+
+
+def _find_circles_tile(frame, bounds):
+    """
+    Runs on a tile thread. Returns (circles in frame pixels, distance of every circle from the tile's
+    inner edges, stage durations).
+    """
+    x1, y1, x2, y2 = bounds
+    h, w = frame.shape[:2]
+    with stage_timing.collect() as durations:
+        circles = _find_circles(_preprocess(frame[y1:y2, x1:x2]))
+    circles = circles + np.array([x1, y1, 0], np.float32)
+
+    # Edges at the frame border don't cut balls in half, only the edges shared with other tiles count
+    edges = [circles[:, 0] - x1 if x1 > 0 else None, x2 - circles[:, 0] if x2 < w else None,
+             circles[:, 1] - y1 if y1 > 0 else None, y2 - circles[:, 1] if y2 < h else None]
+    inner = [edge for edge in edges if edge is not None]
+    distances = np.min(inner, axis=0) if inner else np.full(len(circles), np.inf, np.float32)
+    return circles, distances, durations
+
+
+def _find_circles_tiled(frame, tiles):
+    """
+    HoughCircles on overlapping tiles of the frame, DETECTION_THREADS tiles at a time (OpenCV releases the GIL,
+    so the tiles run on separate cores). A ball in the overlap is found by several tiles; circles closer than
+    minDist are merged, keeping the one furthest from its tile's inner edges (the least cut off).
+    Returns:
+        np.ndarray: Array of shape (n, 3) with (x, y, r) of every circle, in the frame's pixels.
+    """
+    h, w = frame.shape[:2]
+    pool = _get_tile_pool()
+    with stage("tiles"):
+        results = list(pool.map(lambda bounds: _find_circles_tile(frame, bounds), _tile_bounds(w, h, tiles)))
+
+    for _, _, durations in results:
+        stage_timing.add(durations)
+    circles = np.concatenate([circles for circles, _, _ in results])
+    distances = np.concatenate([distances for _, distances, _ in results])
+
+    merged = []
+    for i in np.argsort(-distances, kind="stable"):
+        x, y, _ = circles[i]
+        if all(np.hypot(x - kx, y - ky) >= HOUGH_PARAMS["minDist"] for kx, ky, _ in merged):
+            merged.append(circles[i])
+    return np.array(merged, np.float32).reshape(-1, 3)
+
+
+def _find_circle_near(frame, x, y, max_offset):
+    """
+    Run HoughCircles in the full resolution window around (x, y) that holds a ball up to max_offset pixels away.
+    Returns:
+        tuple | None: (x, y, r) of the circle closest to (x, y) in frame pixels, or None if there is none
+            within max_offset.
+    """
+    half = int(HOUGH_PARAMS["maxRadius"] + max_offset)
+    h, w = frame.shape[:2]
+    x1, y1 = max(int(x) - half, 0), max(int(y) - half, 0)
+    x2, y2 = min(int(x) + half + 1, w), min(int(y) + half + 1, h)
+    if x2 - x1 < 2 * HOUGH_PARAMS["minRadius"] or y2 - y1 < 2 * HOUGH_PARAMS["minRadius"]:
+        return None
+
+    circles = _find_circles(_preprocess(frame[y1:y2, x1:x2]))
+    if not len(circles):
+        return None
+
+    # Keep the circle closest to (x, y), the window may catch a neighbour. If the ball is gone,
+    # the neighbour is all that is left, and it is no match.
+    distances = np.hypot(*(circles[:, :2] + (x1, y1) - (x, y)).T)
+    closest = np.argmin(distances)
+    if distances[closest] > max_offset:
+        return None
+    cx, cy, cr = circles[closest]
+    return (cx + x1, cy + y1, cr)
+
+
+def get_ball_positions_near(frame, centers, search_radius=15):
+    """
+    Look for one ball around each of the given centers, e.g. the positions a tracker predicts.
+    Much cheaper than get_ball_positions, only small windows around the centers are searched.
+    Args:
+        centers (list): List of (x, y) centers in frame pixels.
+        search_radius (int): How far (pixels) a ball may be from its center.
+    Returns:
+        list: Aligned with centers, (x, y, color) tuple or None where no ball was found.
+    """
+    found = [_find_circle_near(frame, x, y, search_radius) for x, y in centers]
+
+    ball_centers = [(int(round(c[0])), int(round(c[1])), 25) for c in found if c is not None]
+    balls_with_color = iter(detect_color_from_balls(ball_centers, frame))
+    return [next(balls_with_color) if c is not None else None for c in found]
+
+
+def test_get_ball_positions(frame, show=True):
     """
     Detect centers of balls in the frame using HoughCircles
+    show=False skips the debug window (e.g. headless benchmarks)
     Returns list of (x, y, color) tuples
     """
     # Convert to HSV color space and increase brightness
     # This helps in detecting colored balls more effectively
     # Increase brightness by adding a constant value to the V channel 
-    frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    frame_hsv[:, :, 2] = np.clip(frame_hsv[:, :, 2] + 150, 0, 255)
+    with stage("color_convert"):
+        frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        frame_hsv[:, :, 2] = np.clip(frame_hsv[:, :, 2] + 150, 0, 255)
 
-    # Convert the difference to grayscale
-    gray = cv2.cvtColor(frame_hsv, cv2.COLOR_BGR2GRAY)
+        # Convert the difference to grayscale
+        gray = cv2.cvtColor(frame_hsv, cv2.COLOR_BGR2GRAY)
 
     # Add blur to reduce noise
     # Using median blur to preserve edges while reducing noise
-    gray_blur = cv2.medianBlur(gray, 5)
-    cv2.imshow("Gray Blur", gray_blur)
+    with stage("blur"):
+        gray_blur = cv2.medianBlur(gray, 5)
+    if show:
+        cv2.imshow("Gray Blur", gray_blur)
 
     # Use HoughCircles to detect circular objects
-    circles = cv2.HoughCircles(
-        gray_blur,
-        cv2.HOUGH_GRADIENT_ALT,  # Alternative Hough gradient method - more accurate
-        dp=1.5,  # Inverse ratio of the accumulator resolution to the image resolution
-        minDist=18,  # Minimum distance between the centers of the detected circles
-        param1=100,  # Higher threshold for the internal Canny edge detector
-        param2=0.9,  # Accumulator threshold for the circle centers (0.0-1.0 for ALT version)
-        minRadius=20,  # Minimum circle radius to be detected
-        maxRadius=30,  # Maximum circle radius to be detected
-    )
+    with stage("hough"):
+        circles = cv2.HoughCircles(
+            gray_blur,
+            cv2.HOUGH_GRADIENT_ALT,  # Alternative Hough gradient method - more accurate
+            dp=1.5,  # Inverse ratio of the accumulator resolution to the image resolution
+            minDist=18,  # Minimum distance between the centers of the detected circles
+            param1=100,  # Higher threshold for the internal Canny edge detector
+            param2=0.9,  # Accumulator threshold for the circle centers (0.0-1.0 for ALT version)
+            minRadius=20,  # Minimum circle radius to be detected
+            maxRadius=30,  # Maximum circle radius to be detected
+        )
 
     ball_centers = []
     if circles is not None:
@@ -82,27 +425,100 @@ def test_get_ball_positions(frame):
 
 
 
+# HSV ranges of the ball colors (you can adjust these based on your balls).
+# A color can have several ranges, they are checked in this order and the first match wins.
+COLOR_RANGES = {
+    "red": [((160, 120, 235), (180, 200, 255))],
+    "brown": [((160, 170, 167), (179, 200, 240))],
+    "green": [((91, 90, 100), (111, 255, 255))],
+    "blue": [((111, 0, 0), (131, 255, 255))],
+    "yellow": [((19, 70, 0), (39, 255, 255))],
+    "black": [((130, 36, 70), (190, 100, 149))],
+    "white": [((0, 0, 200), (20, 20, 255))],
+}
+
+
+
+def set_color_ranges(color_ranges):
+    """
+    Replace COLOR_RANGES, e.g. with tuned ranges.
+    Args:
+        color_ranges (dict): Color name -> list of (lower, upper) HSV ranges.
+    """
+    global COLOR_RANGES, _RANGE_NAMES, _RANGE_LOWER, _RANGE_UPPER
+    COLOR_RANGES = {name: [(tuple(lower), tuple(upper)) for lower, upper in ranges] for name, ranges in color_ranges.items()}
+
+    # COLOR_RANGES flattened into arrays once, so every ball is tested against every range in one comparison
+    _RANGE_NAMES = np.array([name for name, ranges in COLOR_RANGES.items() for _ in ranges] + ["Color"])
+    _RANGE_LOWER = np.array([lower for ranges in COLOR_RANGES.values() for lower, _ in ranges], dtype=np.int16).reshape(-1, 3)
+    _RANGE_UPPER = np.array([upper for ranges in COLOR_RANGES.values() for _, upper in ranges], dtype=np.int16).reshape(-1, 3)
+
+
+set_color_ranges(detector_params.get("detect_balls", "color_ranges") or COLOR_RANGES)
+
+# Offsets of the 20x20 pixel patch around a ball center that is averaged for its color
+_PATCH_OFFSETS = np.arange(-10, 10)
+
+
 def detect_color_from_balls(ball_centers, frame):
     """
     Detect the color of the balls in the frame.
-    Returns a list of tuples with (x, y, average_color).
+    All balls are handled in one batch: the patches around the centers are gathered and averaged
+    together and the means are classified at once (classify_colors).
+    Returns a list of tuples with (x, y, color_name).
     """
     if not ball_centers:
         return []
 
-    color_info = []
-    for x, y, r in ball_centers:
-        # Ensure the center is within the image bounds
+    with stage("color_classification"):
         h, w = frame.shape[:2]
-        x1, y1 = max(x - 10, 0), max(y - 10, 0)
-        x2, y2 = min(x + 10, w), min(y + 10, h)
-        roi = frame[y1:y2, x1:x2]
-        if roi.size == 0:
-            continue
-        avg_color = tuple(int(c) for c in np.mean(roi, axis=(0, 1)))
-        color_info.append((int(x), int(y), check_color_in_range(avg_color)))
+        centers = np.array([(x, y) for x, y, _ in ball_centers], dtype=np.int64)
 
-    return color_info
+        # Patch coordinates of every ball, clipped to the image. The mask drops the clipped pixels from the mean.
+        xs = centers[:, :1] + _PATCH_OFFSETS
+        ys = centers[:, 1:] + _PATCH_OFFSETS
+        x_inside = (xs >= 0) & (xs < w)
+        y_inside = (ys >= 0) & (ys < h)
+        patches = frame[np.clip(ys, 0, h - 1)[:, :, None], np.clip(xs, 0, w - 1)[:, None, :]]
+        mask = y_inside[:, :, None] & x_inside[:, None, :]
+
+        counts = mask.sum(axis=(1, 2))
+        visible = counts > 0  # Balls with no pixels in the image are skipped
+        sums = (patches * mask[..., None]).sum(axis=(1, 2))
+        mean_colors = (sums[visible] // counts[visible, None]).astype(np.uint8)
+
+        color_names = classify_colors(mean_colors)
+        return [(int(x), int(y), name) for (x, y), name in zip(centers[visible], color_names)]
+
+
+def classify_colors(bgr_colors):
+    """
+    Name the ball colors of BGR colors with the calibrated color lookup table (color_model.py),
+    or with COLOR_RANGES if the colors have not been calibrated.
+    Args:
+        bgr_colors (np.ndarray): uint8 array of shape (n, 3) of BGR colors.
+    Returns:
+        list: Color name of each color, "Color" if it is no ball color.
+    """
+    lut = color_model.get_lut()
+    if lut is not None:
+        return lut.classify(bgr_colors)
+    return classify_hsv_colors(cv2.cvtColor(bgr_colors[None], cv2.COLOR_BGR2HSV)[0])
+
+
+def classify_hsv_colors(hsv_colors):
+    """
+    Match HSV colors against COLOR_RANGES.
+    Args:
+        hsv_colors (np.ndarray): Array of shape (n, 3) of HSV colors.
+    Returns:
+        list: Color name of each color, "Color" if no range matches.
+    """
+    hsv = hsv_colors.astype(np.int16)[:, None, :]
+    matches = np.all((hsv >= _RANGE_LOWER) & (hsv <= _RANGE_UPPER), axis=2)
+    # argmax finds the first matching range, rows without a match point at the trailing "Color"
+    first_match = np.where(matches.any(axis=1), matches.argmax(axis=1), len(_RANGE_NAMES) - 1)
+    return _RANGE_NAMES[first_match].tolist()
 
 
 def check_color_in_range(color):
@@ -110,28 +526,9 @@ def check_color_in_range(color):
     Check if the given color is within the defined ranges for colored balls.
     Args:
         color (tuple): A tuple representing the BGR color (B, G, R).
-    Returns color name if color is detected, otherwise False.
-    """
-    # Define color ranges (you can adjust these based on your balls)
-    color_ranges = {
-        "red": [(np.array([160, 120, 235]), np.array([180, 200, 255]))],
-        "brown": [(np.array([160, 170, 167]), np.array([179, 200, 240]))],
-        "green": [(np.array([91, 90, 100]), np.array([111, 255, 255]))],
-        "blue": [(np.array([111, 0, 0]), np.array([131, 255, 255]))],
-        "yellow": [(np.array([19, 70, 0]), np.array([39, 255, 255]))],
-        "black": [(np.array([130, 36, 70]), np.array([190, 100, 149]))],
-        "white": [(np.array([0, 0, 200]), np.array([20, 20, 255]))],
-    }
-
-    # Convert average color to HSV format
-    avg_color_hsv = cv2.cvtColor(np.uint8([[color]]), cv2.COLOR_BGR2HSV)[0][0]
-
-    for color_name, ranges in color_ranges.items():
-        for lower, upper in ranges:
-            if np.all(avg_color_hsv >= lower) and np.all(avg_color_hsv <= upper):
-                return color_name
-
-    return "Color"
+    Returns color name if color is detected, otherwise "Color".
+    """
+    return classify_colors(np.uint8([color]))[0]
 
 
 def detect_from_video():
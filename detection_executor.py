@@ -0,0 +1,297 @@
+"""
+Ball detection in worker processes, so HoughCircles never blocks the eventlet hub.
+Frames are handed to the workers through shared memory (only a small job description is pickled),
+only the newest submitted frame is kept while all workers are busy, and results are delivered
+back on the hub through listeners and wait_for_result().
+With a tracker (ball_tracker.BallTracker), most frames only search small windows around the
+predicted ball positions instead of running detection on the whole frame.
+"""
+import multiprocessing
+import os
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import eventlet
+import eventlet.hubs
+from eventlet.event import Event
+import numpy as np
+
+import metrics
+import stage_timing
+import table_calibration
+
+
+class DetectionResult(NamedTuple):
+    """
+    Ball positions detected from the frame with the given seq and capture timestamp.
+    positions are (x, y, color) in frame pixels, table_positions the matching (x, y) in mm
+    on the table, or None if the table corners are not calibrated.
+    ids are the tracker's ball ids matching positions, or None without tracking.
+    """
+    seq: int
+    timestamp: float
+    positions: list
+    table_positions: list | None = None
+    ids: list | None = None
+
+
+def _worker_main(conn):
+    """
+    Worker process loop: wait for a job, run detection on the frame in shared memory, send the result back.
+    A job is (seq, timestamp, shared memory name, frame shape, centers, search radius, jpeg), None stops the worker.
+    With centers only the windows around them are searched and the positions are aligned with them.
+    In MJPEG pass-through mode jpeg is (JPEG bytes, needs a flip) and the worker decodes the frame itself,
+    shared memory is not used.
+    The result is (seq, timestamp, positions, stage durations), the durations include the whole "detect".
+    """
+    import cv2
+    import detect_balls
+
+    # The pipe was created by a monkey patched (non-blocking) parent, the worker wants plain blocking reads
+    os.set_blocking(conn.fileno(), True)
+    # Every worker is its own process already, more OpenCV threads per worker only fight for the same cores
+    cv2.setNumThreads(1)
+    segments = {}
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+
+        seq, timestamp, shm_name, shape, centers, search_radius, jpeg = job
+        with stage_timing.collect() as durations:
+            if jpeg is None:
+                segment = segments.get(shm_name)
+                if segment is None:
+                    segment = shared_memory.SharedMemory(name=shm_name)
+                    segments[shm_name] = segment
+                frame = np.ndarray(shape, dtype=np.uint8, buffer=segment.buf)
+                # The hub writes the next job's frame into the same memory, detection only reads it
+                frame.flags.writeable = False
+            else:
+                frame = _decode(jpeg)
+
+            try:
+                if frame is None:
+                    raise ValueError("the frame's JPEG could not be decoded")
+                with stage_timing.stage("detect"):
+                    if centers is None:
+                        positions = detect_balls.get_ball_positions(frame)
+                    else:
+                        positions = detect_balls.get_ball_positions_near(frame, centers, search_radius)
+                positions = [(int(ball[0]), int(ball[1]), ball[2]) if ball else None for ball in positions]
+            except Exception as e:
+                print(f"Error detecting balls in worker: {e}")
+                positions = None
+        conn.send((seq, timestamp, positions, durations))
+
+    for segment in segments.values():
+        segment.close()
+
+
+def _decode(jpeg):
+    """Decode a pass-through frame in the worker, mirrored to the app's orientation if needed."""
+    import cv2
+
+    data, flip = jpeg
+    with stage_timing.stage("decode"):
+        frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if frame is not None and flip:
+        with stage_timing.stage("flip"):
+            cv2.flip(frame, 1, dst=frame)
+    return frame
+
+
+class _Worker:
+    """Hub side handle of one worker process and its shared memory frame slot."""
+
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        # recv() is only called once the hub saw the result arrive, and must then read all of it in one go
+        os.set_blocking(self.conn.fileno(), True)
+        self.process = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.segment: shared_memory.SharedMemory | None = None
+        self.track_ids = None  # Tracks searched by the job in progress, None for full detection
+
+    def send(self, frame, centers=None, search_radius=0):
+        if frame.jpeg is not None:
+            # Only the compressed frame crosses the pipe, the worker decodes it
+            self.conn.send((frame.seq, frame.timestamp, None, None, centers, search_radius, (frame.jpeg, frame.jpeg_flip)))
+            return
+
+        image = frame.image
+        # (Re)allocate the slot when the first frame arrives or the resolution grows
+        if self.segment is None or self.segment.size < image.nbytes:
+            self._free_segment()
+            self.segment = shared_memory.SharedMemory(create=True, size=image.nbytes)
+
+        slot = np.ndarray(image.shape, dtype=np.uint8, buffer=self.segment.buf)
+        slot[:] = image
+        self.conn.send((frame.seq, frame.timestamp, self.segment.name, image.shape, centers, search_radius, None))
+
+    def _free_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        self._free_segment()
+
+
+class DetectionExecutor:
+    """
+    Runs ball detection on a pool of worker processes.
+    submit() never blocks: the frame goes to an idle worker, or replaces the frame waiting for one.
+    Results arrive on the hub in seq order; a result older than one already delivered is dropped
+    (a tracker still gets older full detections, see _deliver).
+    Frames are images in ring (cv_module.FrameRing), their slot is held while they are copied to a worker.
+    """
+
+    def __init__(self, workers=2, tracker=None, ring=None):
+        self.n_workers = workers
+        self.tracker = tracker
+        self.ring = ring
+        self.latest_result: DetectionResult | None = None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers: list[_Worker] = []
+        self._idle: list[_Worker] = []
+        self._pending = None
+        self._last_dispatched_seq = -1
+        self._listeners = []
+        self._new_result = Event()
+
+    def start(self):
+        """Start the worker processes if they are not running yet."""
+        if self._workers:
+            return
+        print(f"Starting {self.n_workers} detection worker(s)")
+        for _ in range(self.n_workers):
+            worker = _Worker(self._ctx)
+            self._workers.append(worker)
+            self._idle.append(worker)
+            eventlet.spawn(self._read_results, worker)
+
+    def stop(self):
+        """Stop the worker processes and free their shared memory."""
+        workers, self._workers, self._idle = self._workers, [], []
+        for worker in workers:
+            worker.stop()
+
+    def add_listener(self, callback):
+        """
+        Call callback(result) on the hub for every new DetectionResult.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def submit(self, frame):
+        """
+        Queue a frame for detection. Only the newest queued frame is kept, and a frame that
+        is already queued or being processed is not queued again.
+        Args:
+            frame (cv_module.Frame): The frame to detect balls in.
+        Returns:
+            bool: True if the frame was queued.
+        """
+        self.start()
+        if frame.seq <= self._last_dispatched_seq:
+            return False
+        if self._pending is not None and frame.seq <= self._pending.seq:
+            return False
+
+        if self._pending is not None:
+            # The waiting frame is replaced before a worker got to it
+            metrics.frames_dropped.inc(consumer="detection")
+        self._pending = frame
+        self._dispatch()
+        return True
+
+    def wait_for_result(self, min_seq, timeout=None):
+        """
+        Wait for a result of a frame at least as new as min_seq.
+        Returns:
+            DetectionResult | None: The result, or None on timeout.
+        """
+        result = self.latest_result
+        with eventlet.Timeout(timeout, False):
+            while result is None or result.seq < min_seq:
+                result = self._new_result.wait()
+            return result
+        return None
+
+    def _dispatch(self):
+        while self._pending is not None and self._idle:
+            frame, self._pending = self._pending, None
+            self._last_dispatched_seq = frame.seq
+            with self.ring.hold(frame) if self.ring is not None else nullcontext(True) as intact:
+                if not intact:
+                    # Waited so long that the capture loop reused its slot
+                    metrics.frames_dropped.inc(consumer="detection")
+                    continue
+
+                worker = self._idle.pop()
+                plan = self.tracker.plan(frame) if self.tracker else None
+                if plan is None:
+                    worker.track_ids = None
+                    worker.send(frame)
+                else:
+                    worker.track_ids, centers = plan
+                    worker.send(frame, centers, self.tracker.search_radius)
+
+    def _read_results(self, worker):
+        while worker in self._workers:
+            try:
+                # Wait on the hub until the worker has written a result, then recv() finds it there and doesn't block.
+                # No tpool thread is held while waiting, those are needed for reading the camera and encoding.
+                eventlet.hubs.trampoline(worker.conn.fileno(), read=True)
+                seq, timestamp, positions, durations = worker.conn.recv()
+            except (EOFError, OSError):
+                print("Detection worker exited")
+                if worker in self._workers:
+                    self._workers.remove(worker)
+                break
+
+            metrics.observe_stages(durations)
+            track_ids = worker.track_ids
+            if worker in self._workers:
+                self._idle.append(worker)
+                self._dispatch()
+            if positions is not None:
+                self._deliver(DetectionResult(seq, timestamp, positions), track_ids)
+
+    def _deliver(self, result, track_ids=None):
+        stale = self.latest_result is not None and result.seq <= self.latest_result.seq
+        if stale and (self.tracker is None or track_ids is not None):
+            return
+        if self.tracker:
+            # A full detection finishing after the window search of a later frame still goes to the tracker,
+            # plan() counts on it to pick up new balls and lost tracks. Only the newer result is published.
+            result = self.tracker.update(result, track_ids)
+        if stale:
+            return
+
+        calibration = table_calibration.get_calibration()
+        if calibration is not None:
+            table_positions = calibration.to_table_coords([(x, y) for x, y, _ in result.positions])
+            result = result._replace(table_positions=table_positions)
+        self.latest_result = result
+
+        event, self._new_result = self._new_result, Event()
+        event.send(result)
+        for callback in list(self._listeners):
+            try:
+                callback(result)
+            except Exception as e:
+                print(f"Error in detection listener: {e}")
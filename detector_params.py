@@ -0,0 +1,67 @@
+"""
+Tuned detector parameters, written by tune_detector.py and loaded by the detectors when they are imported.
+Anything missing from the file keeps the default typed into the detector.
+
+calibration/detector_params.json:
+    {
+        "detect_balls": {
+            "preprocess": {"alpha": 1.4, "beta": 10, "blur_sigma": 3},
+            "hough": {"dp": 1.5, "minDist": 20, "param1": 200, "param2": 0.9, "minRadius": 20, "maxRadius": 30},
+            "color_ranges": {"red": [[[160, 120, 235], [180, 200, 255]]], ...}
+        },
+        "ball_recognition": {
+            "color_ranges": {"red": {"low1": [0, 150, 220], "high1": [10, 255, 255], "low2": [...], "high2": [...]}, "dark_red": null, ...}
+        }
+    }
+"""
+import json
+from pathlib import Path
+
+import settings
+
+_params: dict | None = None
+
+
+def load(path=None):
+    """
+    Load the tuned parameters.
+    Returns:
+        dict: The parameters by detector, empty if the file doesn't exist or can't be read.
+    """
+    path = Path(path or settings.DETECTOR_PARAMS_FILE)
+    if not path.exists():
+        return {}
+
+    try:
+        return json.loads(path.read_text())
+    except ValueError as e:
+        print(f"Error loading detector parameters from {path}: {e}")
+        return {}
+
+
+def save(params, path=None):
+    """
+    Save tuned parameters, merging them per detector section with what is already in the file.
+    """
+    path = Path(path or settings.DETECTOR_PARAMS_FILE)
+    data = load(path)
+    for detector, sections in params.items():
+        data.setdefault(detector, {}).update(sections)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=4))
+    print(f"Detector parameters saved to {path}")
+
+
+def get(detector, section):
+    """
+    Get one section of a detector's tuned parameters (loaded on first use, once per process).
+    Returns:
+        dict | None: The section, or None if it has not been tuned.
+    """
+    global _params
+    if _params is None:
+        _params = load()
+        if _params:
+            print(f"Tuned detector parameters loaded from {settings.DETECTOR_PARAMS_FILE}")
+    return _params.get(detector, {}).get(section)
@@ -5,12 +5,17 @@ Run this python file to start the Flask server and access the camera functionali
 """
 # This needs to be first beucase reasons :D
 import eventlet
-eventlet.monkey_patch()
+# Detection worker processes re-import this file as __mp_main__, they don't run the server and must stay unpatched
+if __name__ != "__mp_main__":
+    eventlet.monkey_patch()
 
 
 
 import flask
 import cv_module
+import metrics
+import profiler
+import settings
 from pathlib import Path
 from flask_socketio import SocketIO
 import socket_handlers
@@ -40,16 +45,35 @@ def index():
 # Route for getting a new (pre strike) image from the camera
 @app.route("/get-image")
 def get_image():
+    # ?seq= (frame seq) or ?ts= (capture time, unix seconds) picks the frame nearest to the button press
+    # from the frame ring, without either the newest frame is returned
+    seq = flask.request.args.get("seq", type=int)
+    timestamp = flask.request.args.get("ts", type=float)
+
     # Get a picture from the cv_module, and if it fails, return an error response
-    image_bytes = cv_module.get_picture()
-    if image_bytes is None:
+    picture = cv_module.get_picture_at(seq, timestamp)
+    if picture is None:
         print("Error capturing image from camera in /get-image")
         return "Error capturing image", 500
-    
 
+    # Return the image bytes as a response with the appropriate MIME type, and which frame they are
+    frame, image_bytes = picture
+    response = flask.Response(image_bytes, mimetype='image/jpeg')
+    response.headers["X-Frame-Seq"] = str(frame.seq)
+    response.headers["X-Frame-Timestamp"] = f"{frame.timestamp:.3f}"
+    # 0 for a camera JPEG served unmirrored (MJPEG pass-through), the page mirrors it
+    response.headers["X-Frame-Mirrored"] = "0" if frame.jpeg_flip else "1"
+    return response
 
-    # Return the image bytes as a response with the appropriate MIME type
-    return flask.Response(image_bytes, mimetype='image/jpeg')
+
+# Route telling the page if the live video has to be mirrored. In MJPEG pass-through mode the camera's JPEGs
+# are served unmirrored, until the camera falls back to decoding. The page asks again every few seconds.
+@app.route("/get-video-orientation")
+def get_video_orientation():
+    stream = cv_module.get_stream()
+    # Before the first frame nobody knows yet if the camera streams MJPEG
+    stream.wait_for_frame(timeout=2)
+    return flask.jsonify({"mirror": stream.client_mirror})
 
 
 # Route to get the positions of the balls on the table. This will be rewritten to use sockets soon
@@ -61,7 +85,7 @@ def get_ball_positions():
     if positions:
         serializable_balls = []
         for ball in positions:
-            regular_int_ball = (ball[0], ball[1], ball[2])  # Convert to int for JSON serialization
+            regular_int_ball = tuple(ball)  # (x, y, color) plus table coordinates (mm) when the table is calibrated
             serializable_balls.append(regular_int_ball)
 
     print(f"Positions: {positions}")
@@ -77,8 +101,13 @@ def get_ball_positions():
 # Route to get the live video stream from the camera
 @app.route("/get-live-video")
 def get_live_video():
+    # Clients can ask for a fixed profile (?profile=low), by default one is picked from their throughput
+    profile = flask.request.args.get("profile", "auto")
+    if profile != "auto" and profile not in cv_module.STREAM_PROFILES:
+        return f"Unknown video profile: {profile}", 400
+
     # Get the live video generator from the cv_module, and if it fails, return an error response
-    video_generator = cv_module.get_live_video()
+    video_generator = cv_module.get_live_video(profile)
     if video_generator is None:
         return "Error starting live video stream", 500
     
@@ -86,10 +115,11 @@ def get_live_video():
     return flask.Response(video_generator, mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
-# Route to capture and save image of the table
+# Route to capture the empty table, the background model of ball detection (background_model.py),
+# and save its image
 @app.route("/capture-table", methods=["POST"])
 def capture_table():
-    image_bytes = cv_module.get_picture()
+    image_bytes = cv_module.get_empty_table()
     if image_bytes is None:
         return flask.jsonify({"error": "Error capturing image from camera"}), 500
 
@@ -97,11 +127,50 @@ def capture_table():
         image_path = IMAGES_FOLDER / "table.jpg"
         with open(image_path, "wb") as f:
             f.write(image_bytes)
-        return flask.jsonify({"message": "Table image saved"}), 200
+        return flask.jsonify({"message": "Empty table image and background model saved"}), 200
     except Exception as e:
         print(f"Error saving image: {e}")
         return flask.jsonify({"error": "Error saving image"}), 500
     
+
+# Route for Prometheus to scrape the server metrics (frame rates, stage timings, clients, bytes sent)
+@app.route("/metrics")
+def get_metrics():
+    return flask.Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def is_admin(request):
+    """
+    Returns:
+        bool: True if the request carries the admin token, or comes from this machine when no token is set.
+    """
+    if settings.ADMIN_TOKEN:
+        token = request.args.get("token") or request.headers.get("X-Admin-Token")
+        return token == settings.ADMIN_TOKEN
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+# Route to profile the live server, e.g. /admin/profile?seconds=20 > server.folded (see profiler.py)
+@app.route("/admin/profile")
+def admin_profile():
+    if not is_admin(flask.request):
+        return "Forbidden", 403
+
+    try:
+        seconds = float(flask.request.args.get("seconds", 10))
+        interval = float(flask.request.args.get("interval_ms", 10)) / 1000
+    except ValueError:
+        return "seconds and interval_ms must be numbers", 400
+    if seconds <= 0 or interval <= 0:
+        return "seconds and interval_ms must be positive", 400
+    greenthreads = flask.request.args.get("greenthreads", "1") != "0"
+
+    try:
+        stacks = profiler.profile(seconds, interval, greenthreads)
+    except profiler.ProfilerBusy as e:
+        return str(e), 409
+    return flask.Response(stacks, mimetype="text/plain")
+
 ##################################### ROUTES #####################################
 
 
@@ -0,0 +1,380 @@
+"""
+Where the frames of a CameraStream come from.
+Besides the real camera, frames can be replayed from a video file or a directory of JPEGs, or rendered
+by a synthetic table with balls at known positions, so the whole pipeline runs without a table
+(CI, dev boxes, benchmarks). Every non-camera source plays back in real time or as fast as possible.
+
+Selected with settings.FRAME_SOURCE, e.g.
+    SNOOKER_FRAME_SOURCE=video SNOOKER_FRAME_SOURCE_PATH=recordings/break.mp4 python flask_app.py
+    SNOOKER_FRAME_SOURCE=synthetic SNOOKER_FRAME_SOURCE_REALTIME=0 python flask_app.py
+
+read() blocks (device reads, file decoding, pacing sleeps), so it is meant to be called off the
+eventlet hub, like CameraStream does with tpool. read(image=buffer) writes the frame into a preallocated
+buffer of the same shape (CameraStream passes its ring slot), so the capture path allocates nothing per frame.
+
+In MJPEG pass-through mode (settings.MJPEG_PASSTHROUGH) the camera is asked for MJPEG and read_jpeg() returns
+its compressed frames as they are, without decoding (and without the mirroring, the client does that).
+"""
+import platform
+from pathlib import Path
+from typing import NamedTuple
+
+import cv2
+import eventlet.patcher
+import numpy as np
+
+import settings
+from stage_timing import stage
+
+# read() runs on a native thread, where a monkey patched (green) sleep must not be used
+_time = eventlet.patcher.original("time")
+
+_MJPG = cv2.VideoWriter_fourcc(*"MJPG")
+
+
+class FrameSource:
+    """
+    Base class of the frame sources.
+    read() returns the next frame in the orientation the rest of the app uses (mirrored camera view),
+    or None if no frame is available right now. With image, a buffer of the frame's shape, the frame is
+    written into it and image is returned; a buffer of another shape is ignored and a new frame returned.
+    Sources with jpeg_passthrough also have read_jpeg(), the next frame's JPEG bytes without decoding them.
+    jpeg_needs_flip tells those JPEGs are not mirrored to the app's orientation yet.
+    """
+    jpeg_passthrough = False
+    jpeg_needs_flip = False
+
+    def __init__(self, fps=30.0, realtime=True):
+        self.fps = fps
+        self.realtime = realtime
+        self._next_frame_time = None
+
+    def read(self, image=None):
+        raise NotImplementedError
+
+    def read_jpeg(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    @staticmethod
+    def _fits(frame, image):
+        return image is not None and image.shape == frame.shape and image.dtype == frame.dtype
+
+    @classmethod
+    def _into(cls, frame, image):
+        """Copy a frame the source had to allocate anyway (e.g. a decoded file) into the caller's buffer."""
+        if not cls._fits(frame, image):
+            return frame
+        np.copyto(image, frame)
+        return image
+
+    def _pace(self):
+        """In real time mode, sleep until the next frame is due."""
+        if not self.realtime or not self.fps:
+            return
+        now = _time.monotonic()
+        if self._next_frame_time is None or now - self._next_frame_time > 1:
+            # First frame, or we fell far behind: don't try to catch up with a burst of frames
+            self._next_frame_time = now
+        elif self._next_frame_time > now:
+            _time.sleep(self._next_frame_time - now)
+        self._next_frame_time += 1 / self.fps
+
+
+class CameraSource(FrameSource):
+    """
+    The table camera. Paced by the device itself, frames are flipped to the mirrored view.
+    With passthrough the camera is opened in MJPEG mode and read_jpeg() returns its JPEGs unmirrored.
+    If the camera can't do MJPEG, passthrough is switched off and frames are decoded as usual.
+    """
+    jpeg_needs_flip = True
+
+    def __init__(self, camera_index=0, size=(1280, 720), passthrough=False):
+        super().__init__(fps=None, realtime=False)
+        self.camera_index = camera_index
+        self.size = size
+        self.jpeg_passthrough = passthrough
+        self._cap = None
+        self._raw = None  # Reused for every device read, the flip writes the mirrored frame out of it
+
+    def _open(self):
+        print("Waiting for camera to be available...")
+        system = platform.system()
+        cap = cv2.VideoCapture(self.camera_index, cv2.CAP_DSHOW) if system == "Windows" else cv2.VideoCapture(self.camera_index)
+        if self.jpeg_passthrough:
+            # The format has to be picked before the resolution, some drivers only offer 720p as MJPEG
+            cap.set(cv2.CAP_PROP_FOURCC, _MJPG)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.size[0])
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.size[1])
+
+        if not cap.isOpened():
+            print("❌ Failed to open camera.")
+            return None
+        if self.jpeg_passthrough:
+            if int(cap.get(cv2.CAP_PROP_FOURCC)) == _MJPG and cap.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+                print("Camera streams MJPEG, passing its JPEGs through")
+            else:
+                print("Camera can't stream MJPEG, decoding its frames instead")
+                self.jpeg_passthrough = False
+        print("Camera initialized successfully")
+        return cap
+
+    def read(self, image=None):
+        if self._cap is None or not self._cap.isOpened():
+            self._cap = self._open()
+            if self._cap is None:
+                return None
+
+        with stage("read"):
+            ret, frame = self._cap.read(self._raw)
+        if not ret:
+            return None
+        self._raw = frame
+        with stage("flip"):
+            return cv2.flip(frame, 1, dst=image if self._fits(frame, image) else None)
+
+    def read_jpeg(self):
+        if self._cap is None or not self._cap.isOpened():
+            self._cap = self._open()
+            if self._cap is None or not self.jpeg_passthrough:
+                return None
+
+        with stage("read"):
+            ret, data = self._cap.read()
+        if not ret:
+            return None
+        data = data.reshape(-1)
+        if data[0] != 0xFF or data[1] != 0xD8:
+            # Some backends accept CONVERT_RGB=0 and still hand out decoded pixels
+            print("Camera is not returning JPEGs, decoding its frames instead")
+            self._cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            self.jpeg_passthrough = False
+            return None
+        return data.tobytes()
+
+    def release(self):
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+class VideoFileSource(FrameSource):
+    """
+    Replays a video file, at the file's frame rate or as fast as it decodes.
+    Recordings are expected in the app's (already mirrored) orientation, flip=True mirrors raw camera recordings.
+    """
+
+    def __init__(self, path, realtime=True, loop=True, flip=False):
+        self.path = str(path)
+        self.loop = loop
+        self.flip = flip
+        self._cap = cv2.VideoCapture(self.path)
+        if not self._cap.isOpened():
+            print(f"❌ Failed to open video file {self.path}")
+        super().__init__(self._cap.get(cv2.CAP_PROP_FPS) or 30.0, realtime)
+        self._raw = None
+
+    def read(self, image=None):
+        # Without a flip the frame is decoded straight into the caller's buffer
+        target = self._raw if self.flip else image
+        with stage("read"):
+            ret, frame = self._cap.read(target)
+            if not ret and self.loop and self._cap.isOpened():
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self._cap.read(target)
+        if not ret:
+            return None
+
+        self._pace()
+        if not self.flip:
+            return frame
+        self._raw = frame
+        with stage("flip"):
+            return cv2.flip(frame, 1, dst=image if self._fits(frame, image) else None)
+
+    def release(self):
+        self._cap.release()
+
+
+class ImageDirectorySource(FrameSource):
+    """
+    Replays the JPEGs of a directory in file name order, at fps or as fast as they decode.
+    With passthrough, read_jpeg() returns the files' bytes without decoding them.
+    """
+
+    def __init__(self, path, fps=30.0, realtime=True, loop=True, passthrough=False):
+        super().__init__(fps, realtime)
+        self.path = Path(path)
+        self.loop = loop
+        self.jpeg_passthrough = passthrough
+        self.files = sorted(p for p in self.path.iterdir() if p.suffix.lower() in (".jpg", ".jpeg")) if self.path.is_dir() else []
+        if not self.files:
+            print(f"❌ No JPEG images found in {self.path}")
+        self._index = 0
+
+    def _next_file(self):
+        if self._index >= len(self.files):
+            if not self.loop or not self.files:
+                return None
+            self._index = 0
+        self._index += 1
+        return self.files[self._index - 1]
+
+    def read(self, image=None):
+        file = self._next_file()
+        if file is None:
+            return None
+
+        with stage("read"):
+            frame = cv2.imread(str(file))
+        if frame is None:
+            return None
+
+        self._pace()
+        return self._into(frame, image)
+
+    def read_jpeg(self):
+        file = self._next_file()
+        if file is None:
+            return None
+
+        with stage("read"):
+            jpeg = file.read_bytes()
+        self._pace()
+        return jpeg
+
+
+class SyntheticBall(NamedTuple):
+    """A ball of the synthetic table. Moving balls (vx, vy in pixels per second) bounce off the cushions."""
+    x: float
+    y: float
+    color: str
+    vx: float = 0.0
+    vy: float = 0.0
+
+
+def _hsv_to_bgr(h, s, v):
+    return tuple(int(c) for c in cv2.cvtColor(np.uint8([[[h, s, v]]]), cv2.COLOR_HSV2BGR)[0, 0])
+
+
+# Ball colors picked inside the HSV ranges of detect_balls.COLOR_RANGES, so the renders classify like the camera.
+# Except pink: COLOR_RANGES has no pink range, so with the default ranges a pink ball is always "Color"
+# (detect_balls tops out at ~0.9 color accuracy). Tuned ranges or the calibrated color table do cover it.
+BALL_COLORS_BGR = {
+    "white": _hsv_to_bgr(10, 10, 230),
+    "red": _hsv_to_bgr(170, 160, 245),
+    "yellow": _hsv_to_bgr(29, 160, 200),
+    "green": _hsv_to_bgr(101, 170, 180),
+    "brown": _hsv_to_bgr(170, 185, 205),
+    "blue": _hsv_to_bgr(121, 130, 130),
+    "pink": _hsv_to_bgr(170, 90, 255),
+    "black": _hsv_to_bgr(150, 90, 72),
+}
+
+CLOTH_BGR = (40, 120, 40)
+SHADOW_BGR = (15, 30, 15)
+BALL_RADIUS = 25
+
+# Balls roughly where they are at the start of a frame, with the cue ball rolling around the table
+DEFAULT_SYNTHETIC_BALLS = (
+    SyntheticBall(480, 520, "white", 240, 130),
+    SyntheticBall(330, 260, "yellow"),
+    SyntheticBall(330, 360, "brown"),
+    SyntheticBall(330, 460, "green"),
+    SyntheticBall(640, 360, "blue"),
+    SyntheticBall(900, 360, "pink"),
+    SyntheticBall(960, 330, "red"),
+    SyntheticBall(960, 390, "red"),
+    SyntheticBall(1010, 360, "red"),
+    SyntheticBall(1150, 360, "black"),
+)
+
+
+class SyntheticTableSource(FrameSource):
+    """
+    Renders a table with balls at known positions. After read(), positions holds the ground truth
+    (x, y, color) of every ball in the returned frame.
+    Frame times advance by 1 / fps per frame, so the motion is the same in real time and fast playback.
+    """
+
+    def __init__(self, balls=DEFAULT_SYNTHETIC_BALLS, size=(1280, 720), fps=30.0, realtime=True, noise=0.0, seed=0):
+        super().__init__(fps, realtime)
+        self.balls = list(balls)
+        self.size = size
+        self.noise = noise
+        self.positions: list[tuple[int, int, str]] = []
+        self._frame_index = 0
+        self._rng = np.random.default_rng(seed)
+        self._background = np.full((size[1], size[0], 3), CLOTH_BGR, np.uint8)
+
+    def positions_at(self, t):
+        """
+        Returns:
+            list: (x, y, color) of every ball t seconds into the playback, in frame pixels.
+        """
+        w, h = self.size
+        positions = []
+        for ball in self.balls:
+            x = _bounce(ball.x + ball.vx * t, BALL_RADIUS, w - 1 - BALL_RADIUS)
+            y = _bounce(ball.y + ball.vy * t, BALL_RADIUS, h - 1 - BALL_RADIUS)
+            positions.append((int(round(x)), int(round(y)), ball.color))
+        return positions
+
+    def render(self, positions, image=None):
+        """
+        Args:
+            image (np.ndarray | None): Buffer to draw the frame into, a new frame if None or of another shape.
+        Returns:
+            np.ndarray: A frame with a ball drawn at each (x, y, color).
+        """
+        if self._fits(self._background, image):
+            frame = image
+            np.copyto(frame, self._background)
+        else:
+            frame = self._background.copy()
+        for x, y, color in positions:
+            # A dark rim like the ball's shadow on the cloth, so every color has an edge to detect
+            cv2.circle(frame, (x, y), BALL_RADIUS, SHADOW_BGR, -1, cv2.LINE_AA)
+            cv2.circle(frame, (x, y), BALL_RADIUS - 3, BALL_COLORS_BGR.get(color, (255, 255, 255)), -1, cv2.LINE_AA)
+        if self.noise:
+            noise = self._rng.normal(0, self.noise, frame.shape)
+            np.copyto(frame, np.clip(frame + noise, 0, 255), casting="unsafe")
+        return frame
+
+    def read(self, image=None):
+        self.positions = self.positions_at(self._frame_index / self.fps)
+        self._frame_index += 1
+        with stage("read"):
+            frame = self.render(self.positions, image)
+        self._pace()
+        return frame
+
+
+def _bounce(value, low, high):
+    """Fold a position moving in a straight line back and forth between low and high."""
+    span = high - low
+    offset = (value - low) % (2 * span)
+    return low + (offset if offset <= span else 2 * span - offset)
+
+
+def get_frame_source(camera_index=0):
+    """
+    Create the frame source configured in settings (FRAME_SOURCE and friends).
+    Returns:
+        FrameSource: A new frame source, the camera if FRAME_SOURCE is unknown.
+    """
+    kind = settings.FRAME_SOURCE
+    path = settings.FRAME_SOURCE_PATH
+    realtime = settings.FRAME_SOURCE_REALTIME
+
+    if kind == "video":
+        return VideoFileSource(path, realtime)
+    if kind == "images":
+        return ImageDirectorySource(path, settings.FRAME_SOURCE_FPS, realtime, passthrough=settings.MJPEG_PASSTHROUGH)
+    if kind == "synthetic":
+        return SyntheticTableSource(fps=settings.FRAME_SOURCE_FPS, realtime=realtime)
+    if kind != "camera":
+        print(f"Unknown frame source {kind!r}, using the camera")
+    return CameraSource(camera_index, passthrough=settings.MJPEG_PASSTHROUGH)
@@ -0,0 +1,250 @@
+"""
+Labelled ground truth datasets and accuracy scoring of the ball detectors.
+A dataset is a directory of frames plus annotations.json with the ball centers and colors of every frame:
+
+    datasets/<name>/
+        annotations.json
+        0000.png, 0001.png, ...
+        background.png          (optional, the empty table for detect_balls_background)
+
+    annotations.json:
+        {
+            "frames": [
+                {"file": "0000.png", "balls": [{"x": 480, "y": 520, "color": "white"}, ...]},
+                ...
+            ]
+        }
+
+Coordinates are frame pixels in the app's (mirrored) orientation, colors the snooker ball names
+(white, red, yellow, green, brown, blue, pink, black).
+
+The scorer matches every detector's output to the annotations and reports precision, recall,
+center error and color accuracy next to its latency, so a speed-up can be judged on both:
+
+    python ground_truth.py generate --output datasets/synthetic --frames 100
+    python ground_truth.py score --dataset datasets/synthetic [--detectors detect_balls detect_balls_pyramid]
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import background_model
+import frame_sources
+from benchmark import DETECTORS, summarize
+
+ANNOTATIONS_FILE = "annotations.json"
+BACKGROUND_FILE = "background.png"
+
+# ball_recognition_test names some colors after pool balls, these are the snooker balls they find
+COLOR_ALIASES = {
+    "dark_red": "red",
+    "orange": "brown",
+    "purple": "pink",
+}
+
+
+def load_dataset(path):
+    """
+    Load the frames and annotations of a dataset.
+    Returns:
+        list: (file name, frame, balls) for every annotated frame, balls a list of (x, y, color).
+    """
+    path = Path(path)
+    annotations = json.loads((path / ANNOTATIONS_FILE).read_text())
+
+    dataset = []
+    for entry in annotations["frames"]:
+        frame = cv2.imread(str(path / entry["file"]))
+        if frame is None:
+            print(f"Could not read {entry['file']}, skipping it")
+            continue
+        balls = [(ball["x"], ball["y"], ball["color"]) for ball in entry["balls"]]
+        dataset.append((entry["file"], frame, balls))
+    return dataset
+
+
+def save_annotations(path, frames):
+    """
+    Write annotations.json of a dataset.
+    Args:
+        frames (list): (file name, balls) for every frame, balls a list of (x, y, color).
+    """
+    annotations = {
+        "frames": [
+            {"file": file, "balls": [{"x": int(x), "y": int(y), "color": color} for x, y, color in balls]}
+            for file, balls in frames
+        ]
+    }
+    Path(path, ANNOTATIONS_FILE).write_text(json.dumps(annotations, indent=4))
+
+
+def generate_synthetic(output, frames=100, noise=3.0, seed=0):
+    """
+    Render a dataset with frame_sources.SyntheticTableSource: random layouts of the colors and up to
+    six reds, some of them touching. Frames are PNGs so the pixels are exactly what was rendered.
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    source = frame_sources.SyntheticTableSource(noise=noise, seed=seed)
+    w, h = source.size
+    margin = frame_sources.BALL_RADIUS + 5
+    min_distance = 2 * frame_sources.BALL_RADIUS + 1
+
+    annotated = []
+    for index in range(frames):
+        colors = ["white", "yellow", "green", "brown", "blue", "pink", "black"] + ["red"] * int(rng.integers(0, 7))
+        balls = []
+        for color in colors:
+            # A few tries to find a free spot, a ball that doesn't fit is left out of the frame
+            for _ in range(50):
+                x, y = int(rng.integers(margin, w - margin)), int(rng.integers(margin, h - margin))
+                if all(np.hypot(x - bx, y - by) >= min_distance for bx, by, _ in balls):
+                    balls.append((x, y, color))
+                    break
+
+        file = f"{index:04d}.png"
+        cv2.imwrite(str(output / file), source.render(balls))
+        annotated.append((file, balls))
+
+    cv2.imwrite(str(output / BACKGROUND_FILE), source.render([]))
+    save_annotations(output, annotated)
+    print(f"Synthetic dataset of {frames} frames written to {output}")
+
+
+def normalize_detections(result):
+    """
+    Bring the output of any detector to (x, y, color) tuples with snooker color names.
+    detect_balls returns a list of (x, y, color), ball_recognition_test a dict of {"x", "y", "r"} lists per color.
+    """
+    if isinstance(result, dict):
+        balls = [(ball["x"], ball["y"], color) for color, circles in result.items() for ball in circles]
+    else:
+        balls = list(result)
+    return [(int(x), int(y), COLOR_ALIASES.get(color, color)) for x, y, color in balls]
+
+
+def match_balls(detected, expected, max_distance):
+    """
+    Greedily match detections to the annotated balls, closest pairs first.
+    Returns:
+        list: (detected index, expected index, center distance) of every match.
+    """
+    if not detected or not expected:
+        return []
+
+    detected_xy = np.array([(x, y) for x, y, _ in detected], dtype=float)
+    expected_xy = np.array([(x, y) for x, y, _ in expected], dtype=float)
+    distances = np.linalg.norm(detected_xy[:, None, :] - expected_xy[None, :, :], axis=2)
+
+    matches = []
+    used_detected, used_expected = set(), set()
+    for d, e in zip(*np.unravel_index(np.argsort(distances, axis=None), distances.shape)):
+        if distances[d, e] > max_distance:
+            break
+        if d in used_detected or e in used_expected:
+            continue
+        matches.append((int(d), int(e), float(distances[d, e])))
+        used_detected.add(d)
+        used_expected.add(e)
+    return matches
+
+
+def score_detector(detect, dataset, max_distance=15):
+    """
+    Run a detector over the dataset and score it against the annotations.
+    Returns:
+        dict: precision, recall, center error (px), color accuracy, fps and latency summary.
+    """
+    true_positives = detections = expected_balls = correct_colors = 0
+    center_errors = []
+    frame_times = []
+
+    for _, frame, expected in dataset:
+        start = time.perf_counter()
+        result = detect(frame)
+        frame_times.append(time.perf_counter() - start)
+
+        detected = normalize_detections(result)
+        matches = match_balls(detected, expected, max_distance)
+        detections += len(detected)
+        expected_balls += len(expected)
+        true_positives += len(matches)
+        for d, e, distance in matches:
+            center_errors.append(distance)
+            correct_colors += detected[d][2] == expected[e][2]
+
+    return {
+        "precision": true_positives / detections if detections else 0.0,
+        "recall": true_positives / expected_balls if expected_balls else 0.0,
+        "center_error_px": {
+            "mean": float(np.mean(center_errors)) if center_errors else None,
+            "p90": float(np.percentile(center_errors, 90)) if center_errors else None,
+        },
+        # Of the balls that were found, how many got the right color
+        "color_accuracy": correct_colors / true_positives if true_positives else 0.0,
+        "fps": len(frame_times) / sum(frame_times),
+        "frame_ms": summarize(frame_times),
+    }
+
+
+def print_scores(scores):
+    print(f"\n{'detector':<30} {'precision':>9} {'recall':>7} {'center err':>10} {'color acc':>9} {'p50 ms':>7} {'fps':>6}")
+    for name, score in scores.items():
+        error = score["center_error_px"]["mean"]
+        print(
+            f"{name:<30} {score['precision']:>9.3f} {score['recall']:>7.3f} "
+            f"{(f'{error:.2f} px' if error is not None else '-'):>10} {score['color_accuracy']:>9.3f} "
+            f"{score['frame_ms']['p50']:>7.2f} {score['fps']:>6.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="Render a synthetic dataset")
+    generate.add_argument("--output", default="datasets/synthetic")
+    generate.add_argument("--frames", type=int, default=100)
+    generate.add_argument("--noise", type=float, default=3.0, help="Std of the pixel noise added to the renders")
+    generate.add_argument("--seed", type=int, default=0)
+
+    score = commands.add_parser("score", help="Score the detectors against a dataset")
+    score.add_argument("--dataset", default="datasets/synthetic")
+    score.add_argument("--detectors", nargs="+", choices=DETECTORS, default=list(DETECTORS))
+    score.add_argument("--max-distance", type=float, default=15, help="Max center distance (px) of a match")
+    score.add_argument("--output", help="Save the scores as JSON")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_synthetic(args.output, args.frames, args.noise, args.seed)
+        return
+
+    dataset = load_dataset(args.dataset)
+    if not dataset:
+        print(f"No frames in {args.dataset}")
+        return
+    print(f"Scoring {len(args.detectors)} detector(s) on {len(dataset)} frames of {args.dataset}")
+    background = Path(args.dataset, BACKGROUND_FILE)
+    if background.exists():
+        background_model.set_model(cv2.imread(str(background)))
+
+    scores = {}
+    for name in args.detectors:
+        print(f"Running {name}...")
+        scores[name] = score_detector(DETECTORS[name], dataset, args.max_distance)
+    print_scores(scores)
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps({"dataset": args.dataset, "frames": len(dataset), "detectors": scores}, indent=4))
+        print(f"\nScores saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
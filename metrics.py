@@ -0,0 +1,163 @@
+"""
+Server metrics in the Prometheus text format, served on /metrics.
+Metrics are updated on the eventlet hub only (stage timings measured on tpool threads or in the
+detection workers are handed back and recorded there), so no locking is needed.
+
+    snooker_frames_captured_total                  frames published by the capture loop
+    snooker_capture_fps                            capture frame rate (smoothed)
+    snooker_frames_dropped_total{consumer}         frames a consumer skipped because it was behind
+    snooker_capture_errors_total                   failed frame reads
+    snooker_stage_seconds{stage}                   read, flip, resize, encode, detect and the detector stages
+    snooker_mjpeg_clients                          live video clients
+    snooker_socket_clients                         connected Socket.IO clients
+    snooker_position_subscribers                   clients subscribed to the position stream
+    snooker_bytes_sent_total{client}               bytes sent to every connected client
+    snooker_position_emit_lag_seconds              frame capture time to position emit
+"""
+import math
+
+# Stage timings from ~0.1 ms (a small resize) to a full second (a stalled camera read)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LAG_BUCKETS = (0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._series: dict[tuple, object] = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def remove(self, **labels):
+        """Forget a labelled series, e.g. of a client that disconnected."""
+        self._series.pop(self._key(labels), None)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for key, value in sorted(self._series.items()):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        self._series[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # Per bucket counts (not cumulative yet), sum, count
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def _render_series(self, key, series):
+        counts, total, count = series
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.label_names, key, [("le", _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+_REGISTRY: list[_Metric] = []
+
+frames_captured = Counter("snooker_frames_captured_total", "Frames published by the capture loop")
+capture_fps = Gauge("snooker_capture_fps", "Capture frame rate, smoothed over the last frames")
+frames_dropped = Counter("snooker_frames_dropped_total", "Frames a consumer skipped because it was behind the camera", ["consumer"])
+capture_errors = Counter("snooker_capture_errors_total", "Frame reads that returned no frame")
+stage_seconds = Histogram("snooker_stage_seconds", "Time spent per processing stage", ["stage"])
+mjpeg_clients = Gauge("snooker_mjpeg_clients", "Connected live video clients")
+socket_clients = Gauge("snooker_socket_clients", "Connected Socket.IO clients")
+position_subscribers = Gauge("snooker_position_subscribers", "Clients subscribed to the position stream")
+bytes_sent = Counter("snooker_bytes_sent_total", "Bytes sent to a connected client", ["client"])
+position_emit_lag = Histogram("snooker_position_emit_lag_seconds", "Time from frame capture to emitting its ball positions", buckets=LAG_BUCKETS)
+
+# Series without labels start at zero, so they show up before the first event
+frames_captured.inc(0)
+capture_errors.inc(0)
+mjpeg_clients.set(0)
+socket_clients.set(0)
+position_subscribers.set(0)
+
+
+def observe_stages(durations):
+    """
+    Record the stage timings collected with stage_timing.collect().
+    Args:
+        durations (dict): Stage name -> seconds.
+    """
+    for stage, seconds in durations.items():
+        stage_seconds.observe(seconds, stage=stage)
+
+
+def render():
+    """
+    Returns:
+        str: Every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,107 @@
+"""
+Compact binary encoding of the ball position stream sent over Socket.IO.
+A keyframe carries every ball; the messages in between only carry the balls that moved, changed
+color or appeared, plus the ids of the balls that disappeared. Clients that join late (or lose
+track) ask for a keyframe. Decoded by static/js/socket.js.
+
+Message (little endian):
+    header   u8 message type (| FLAG_TABLE_COORDS), u32 frame seq, f64 capture timestamp (unix seconds),
+             u16 number of balls, u16 number of removed balls
+    balls    u16 id, i16 x, i16 y, u8 color (+ i16 table_x, i16 table_y in mm with FLAG_TABLE_COORDS)
+    removed  u16 id of every removed ball
+"""
+import struct
+import time
+
+MSG_KEYFRAME = 1
+MSG_DELTA = 2
+FLAG_TABLE_COORDS = 0x80
+
+# Color enum of the stream, index 0 is an unclassified ball ("Color" in detect_balls)
+COLORS = ("Color", "white", "red", "yellow", "green", "brown", "blue", "pink", "black")
+_COLOR_CODES = {name: code for code, name in enumerate(COLORS)}
+
+_HEADER = struct.Struct("<BIdHH")
+_BALL = struct.Struct("<HhhB")
+_BALL_WITH_TABLE = struct.Struct("<HhhBhh")
+_REMOVED = struct.Struct("<H")
+
+
+def _balls_by_id(result):
+    """
+    Returns:
+        dict: id -> (x, y, color code, table_x, table_y) of every ball in a DetectionResult.
+    """
+    # Without a tracker the ids are just list positions, deltas then simply show up as moves
+    ids = result.ids if result.ids is not None else range(len(result.positions))
+    table_positions = result.table_positions or [(0, 0)] * len(result.positions)
+    return {
+        int(ball_id) & 0xFFFF: (int(x), int(y), _COLOR_CODES.get(color, 0), int(tx), int(ty))
+        for ball_id, (x, y, color), (tx, ty) in zip(ids, result.positions, table_positions)
+    }
+
+
+class PositionStreamEncoder:
+    """
+    Turns consecutive DetectionResults into keyframe / delta messages.
+    One encoder per stream of messages: deltas are relative to what this encoder sent last.
+    """
+
+    def __init__(self, keyframe_interval=2.0, min_move=1):
+        self.keyframe_interval = keyframe_interval
+        self.min_move = min_move
+        self._sent: dict[int, tuple] = {}  # Balls as the clients know them
+        self._sent_result = None  # Result of the last message, for seq / timestamp of on-demand keyframes
+        self._last_keyframe = 0.0
+
+    def encode(self, result):
+        """
+        Encode the next result of the stream.
+        Returns:
+            bytes | None: A keyframe when one is due, otherwise a delta, or None if nothing changed.
+        """
+        balls = _balls_by_id(result)
+        if time.monotonic() - self._last_keyframe >= self.keyframe_interval:
+            self._sent = balls
+            self._sent_result = result
+            self._last_keyframe = time.monotonic()
+            return self._pack(MSG_KEYFRAME, result, balls, [])
+
+        changed = {}
+        for ball_id, ball in balls.items():
+            sent = self._sent.get(ball_id)
+            if sent is None or sent[2] != ball[2] or max(abs(ball[0] - sent[0]), abs(ball[1] - sent[1])) >= self.min_move:
+                changed[ball_id] = ball
+        removed = [ball_id for ball_id in self._sent if ball_id not in balls]
+        if not changed and not removed:
+            return None
+
+        self._sent.update(changed)
+        for ball_id in removed:
+            del self._sent[ball_id]
+        self._sent_result = result
+        return self._pack(MSG_DELTA, result, changed, removed)
+
+    def keyframe(self):
+        """
+        Encode every ball as the clients of this stream know them, e.g. for a client that just joined.
+        The deltas that follow apply to it like to every other client, so the stream itself is not reset.
+        Returns:
+            bytes | None: The keyframe, or None if nothing has been encoded yet.
+        """
+        if self._sent_result is None:
+            return None
+        return self._pack(MSG_KEYFRAME, self._sent_result, self._sent, [])
+
+    def _pack(self, msg_type, result, balls, removed):
+        has_table = result.table_positions is not None
+        ball_struct = _BALL_WITH_TABLE if has_table else _BALL
+        if has_table:
+            msg_type |= FLAG_TABLE_COORDS
+
+        parts = [_HEADER.pack(msg_type, result.seq & 0xFFFFFFFF, result.timestamp, len(balls), len(removed))]
+        for ball_id, (x, y, color, tx, ty) in balls.items():
+            values = (ball_id, x, y, color, tx, ty) if has_table else (ball_id, x, y, color)
+            parts.append(ball_struct.pack(*values))
+        parts.extend(_REMOVED.pack(ball_id) for ball_id in removed)
+        return b"".join(parts)
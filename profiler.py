@@ -0,0 +1,131 @@
+"""
+Sampling profiler for the running server, served on /admin/profile.
+A native thread wakes up every interval and records the stack of every OS thread (the hub thread running
+the current greenthread, the tpool threads reading the camera and encoding JPEGs) and, optionally, of every
+suspended greenthread (MJPEG clients waiting to send, Socket.IO handlers, the capture loop between frames).
+tpool threads waiting for work are left out.
+
+The output is in the collapsed stack format flamegraph tools read, one line per unique stack:
+
+    hub;_capture_loop (cv_module.py:190);_publish (cv_module.py:175) 12
+    tpool-3;tworker (tpool.py:55);_encode (cv_module.py:105) 41
+
+    curl "http://localhost:5000/admin/profile?seconds=20" > server.folded
+    flamegraph.pl server.folded > server.svg      (or drop the file on speedscope.app)
+
+Stacks of suspended greenthreads are wall clock time (they are waiting, not using the CPU), leave them out
+with greenthreads=0 to only see where the CPU goes. The detection workers are separate processes and are
+not sampled, their stage timings are in /metrics.
+"""
+import gc
+import os
+import sys
+from collections import Counter
+
+import eventlet.hubs
+import eventlet.patcher
+import greenlet
+from eventlet import tpool
+
+_threading = eventlet.patcher.original("threading")
+_time = eventlet.patcher.original("time")
+
+MAX_SECONDS = 120
+# How often the list of greenthreads is refreshed, walking the gc heap for them every sample would cost too much
+_GREENTHREAD_REFRESH = 1.0
+
+_lock = _threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """A profile is already being taken."""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    # The first line of the function, so all samples of a function merge into one flamegraph box
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(label, frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.append(label)
+    return ";".join(reversed(names))
+
+
+def _is_idle_tpool_thread(frame):
+    """True for a tpool thread waiting for work, the 20 of them would drown out everything else."""
+    callee = None
+    while frame is not None:
+        if frame.f_code is tpool.tworker.__code__:
+            return callee is not None and callee.f_code.co_name == "get"
+        callee, frame = frame, frame.f_back
+    return False
+
+
+def _greenthreads(hub_greenlet):
+    return [obj for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet) and obj.parent is hub_greenlet]
+
+
+def _sample(seconds, interval, hub_greenlet, hub_thread_id):
+    """Runs on a native thread, returns the Counter of collapsed stacks."""
+    own_id = _threading.get_ident()
+    stacks = Counter()
+    greenthreads = []
+    refreshed = 0.0
+    end = _time.monotonic() + seconds
+
+    while True:
+        now = _time.monotonic()
+        if now >= end:
+            break
+
+        names = {thread.ident: thread.name for thread in _threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id or _is_idle_tpool_thread(frame):
+                continue
+            label = "hub" if thread_id == hub_thread_id else names.get(thread_id, f"thread-{thread_id}")
+            stacks[_collapse(label, frame)] += 1
+
+        if hub_greenlet is not None:
+            if now - refreshed >= _GREENTHREAD_REFRESH:
+                greenthreads = _greenthreads(hub_greenlet)
+                refreshed = now
+            for green in greenthreads:
+                # The running greenthread has no gr_frame, it is in the hub thread's stack above
+                frame = green.gr_frame
+                if frame is not None and not green.dead:
+                    stacks[_collapse("greenthread", frame)] += 1
+
+        _time.sleep(max(0.0, interval - (_time.monotonic() - now)))
+
+    return stacks
+
+
+def profile(seconds=10, interval=0.01, greenthreads=True):
+    """
+    Sample the stacks of the running server. Call it from a greenthread: the sampling runs on a
+    tpool thread and only this greenthread waits for it, the server keeps serving everyone.
+    Args:
+        seconds (float): How long to sample, at most MAX_SECONDS.
+        interval (float): Seconds between samples.
+        greenthreads (bool): Also sample suspended greenthreads (wall clock), not just the OS threads.
+    Returns:
+        str: The stacks in the collapsed format, most sampled first.
+    Raises:
+        ProfilerBusy: If another profile is being taken.
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+    try:
+        seconds = min(max(seconds, interval), MAX_SECONDS)
+        hub_greenlet = eventlet.hubs.get_hub().greenlet if greenthreads else None
+        stacks = tpool.execute(_sample, seconds, interval, hub_greenlet, _threading.get_ident())
+    finally:
+        _lock.release()
+
+    print(f"Profiled the server for {seconds:g} s: {sum(stacks.values())} stacks, {len(stacks)} unique")
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,89 @@
+"""
+Runtime settings for the snooker camera server.
+Every value can be overridden with an environment variable of the same name prefixed with SNOOKER_,
+e.g. SNOOKER_DETECTION_WORKERS=2 python flask_app.py
+"""
+import os
+
+
+def _env(name, default):
+    return os.environ.get(f"SNOOKER_{name}", default)
+
+
+def _env_int(name, default):
+    return int(_env(name, default))
+
+
+# Table bed calibration (crop rectangle / corner points) used by detection, see table_calibration.py
+TABLE_CALIBRATION_FILE = _env("TABLE_CALIBRATION_FILE", "calibration/table.json")
+
+# Ball detection mode of detect_balls.get_ball_positions:
+#   "full"     HoughCircles on the full resolution frame
+#   "pyramid"  HoughCircles on a PYRAMID_SCALE downscaled frame, candidates refined at full resolution
+#   "background" difference with the empty table (background_model.py), HoughCircles only for touching balls
+#   "tiled"    HoughCircles on DETECTION_TILES ("columns x rows") overlapping tiles, DETECTION_THREADS at a time.
+#              Every worker process has its own threads, the cores are shared out between the workers.
+DETECTION_MODE = _env("DETECTION_MODE", "full")
+PYRAMID_SCALE = float(_env("PYRAMID_SCALE", 0.5))
+DETECTION_TILES = tuple(int(n) for n in _env("DETECTION_TILES", "2x2").lower().split("x"))
+
+# Number of worker processes running ball detection. One core is left for the web server and the camera.
+# In tiled mode the parallelism comes from the tile threads: one worker (two from 4 cores on, so a frame
+# is detected while the previous one finishes), each with an equal share of the cores.
+_CPUS = os.cpu_count() or 2
+if DETECTION_MODE == "tiled":
+    DETECTION_WORKERS = _env_int("DETECTION_WORKERS", 2 if _CPUS >= 4 else 1)
+else:
+    DETECTION_WORKERS = _env_int("DETECTION_WORKERS", max(1, _CPUS - 1))
+DETECTION_THREADS = _env_int("DETECTION_THREADS", max(1, _CPUS // DETECTION_WORKERS))
+
+# Empty table image of the "background" detection mode, the median of BACKGROUND_FRAMES frames
+# captured by POST /capture-table. A pixel is a ball when it differs more than BACKGROUND_THRESHOLD (0-255)
+# from it in any color channel. Every BACKGROUND_REFRESH_INTERVAL frames the cloth around the balls is
+# blended into it with weight BACKGROUND_REFRESH_RATE, following slow lighting changes.
+BACKGROUND_FILE = _env("BACKGROUND_FILE", "calibration/background.png")
+BACKGROUND_FRAMES = _env_int("BACKGROUND_FRAMES", 25)
+BACKGROUND_THRESHOLD = _env_int("BACKGROUND_THRESHOLD", 40)
+BACKGROUND_REFRESH_INTERVAL = _env_int("BACKGROUND_REFRESH_INTERVAL", 30)
+BACKGROUND_REFRESH_RATE = float(_env("BACKGROUND_REFRESH_RATE", 0.05))
+
+# Track balls between frames (ball_tracker.py): full detection only every TRACKER_FULL_DETECTION_INTERVAL
+# frames or when a ball is lost, small windows around the predicted positions on the frames in between
+TRACKING = _env("TRACKING", "1") == "1"
+TRACKER_FULL_DETECTION_INTERVAL = _env_int("TRACKER_FULL_DETECTION_INTERVAL", 10)
+
+# Seconds between keyframes of the binary ball position stream (position_stream.py), deltas in between
+POSITION_KEYFRAME_INTERVAL = float(_env("POSITION_KEYFRAME_INTERVAL", 2.0))
+
+# Rate tiers (messages per second) of the position stream. A client subscribing with max_rate gets the
+# fastest tier not above it (the slowest tier if all are), without max_rate the fastest tier.
+POSITION_STREAM_RATES = tuple(sorted(float(rate) for rate in _env("POSITION_STREAM_RATES", "5,10,20").split(",")))
+
+# Where frames come from (frame_sources.py): "camera", "video" (file at FRAME_SOURCE_PATH),
+# "images" (directory of JPEGs at FRAME_SOURCE_PATH) or "synthetic" (rendered table with known ball positions).
+# Non-camera sources play back in real time (FRAME_SOURCE_REALTIME=1) or as fast as possible (0);
+# images and synthetic frames at FRAME_SOURCE_FPS, videos at the file's frame rate.
+FRAME_SOURCE = _env("FRAME_SOURCE", "camera")
+FRAME_SOURCE_PATH = _env("FRAME_SOURCE_PATH", "")
+FRAME_SOURCE_REALTIME = _env("FRAME_SOURCE_REALTIME", "1") == "1"
+FRAME_SOURCE_FPS = float(_env("FRAME_SOURCE_FPS", 30))
+
+# MJPEG pass-through: ask the camera for MJPEG and serve its JPEGs to the viewers as they are, instead of
+# decoding, flipping and re-encoding every frame. The client mirrors the video, detection decodes the JPEGs
+# in its worker processes. Also works with FRAME_SOURCE=images. Cameras without MJPEG fall back to decoding.
+MJPEG_PASSTHROUGH = _env("MJPEG_PASSTHROUGH", "0") == "1"
+
+# Frames kept in the frame ring of a camera stream (cv_module.FrameRing), ~3 s at 30 fps. /get-image?seq=|ts=
+# returns the frame nearest to a button press from it. Every frame takes width * height * 3 bytes (2.8 MB at 720p).
+FRAME_RING_FRAMES = _env_int("FRAME_RING_FRAMES", 90)
+
+# Tuned detector parameters (Hough, preprocessing, HSV ranges) written by tune_detector.py, see detector_params.py
+DETECTOR_PARAMS_FILE = _env("DETECTOR_PARAMS_FILE", "calibration/detector_params.json")
+
+# Calibrated ball color lookup table written by calibrate_colors.py, see color_model.py.
+# Both detectors classify colors with it instead of the HSV ranges when it exists.
+COLOR_LUT_FILE = _env("COLOR_LUT_FILE", "calibration/color_lut.npz")
+
+# Token the admin routes (/admin/profile) require as ?token= or an X-Admin-Token header.
+# Without a token they only answer requests from the machine itself.
+ADMIN_TOKEN = _env("ADMIN_TOKEN", "")
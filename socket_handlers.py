@@ -1,42 +1,126 @@
-from flask_socketio import SocketIO
-import eventlet
-import random # JUST FOR TESTING
+import time
+
+from flask import request
+from flask_socketio import SocketIO, join_room, leave_room
 import cv_module
+import metrics
+import settings
+from position_stream import PositionStreamEncoder
+
+
+class _RateTier:
+    """Clients that get positions at (most) the same rate, all in one Socket.IO room with one encoder."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.room = f"positions-{rate:g}"
+        self.encoder = PositionStreamEncoder(settings.POSITION_KEYFRAME_INTERVAL)
+        self.clients = set()
+        self._last_emit = 0.0
+
+    def due(self, now):
+        return now - self._last_emit >= 1 / self.rate
+
+    def emit(self, socketio, result, now):
+        self._last_emit = now
+        message = self.encoder.encode(result)
+        if message is not None:
+            socketio.emit("ball-positions", message, to=self.room)
+            metrics.position_emit_lag.observe(time.time() - result.timestamp)
+            for sid in self.clients:
+                metrics.bytes_sent.inc(len(message), client=sid)
 
-streaming_started = False
 
 def register_socket_events(socketio: SocketIO):
+    tiers = [_RateTier(rate) for rate in settings.POSITION_STREAM_RATES]
+    client_tiers: dict[str, _RateTier] = {}  # sid -> tier of every subscribed client
+
+    def emit_positions(result):
+        now = time.monotonic()
+        for tier in tiers:
+            if tier.clients and tier.due(now):
+                tier.emit(socketio, result, now)
+
+    def pick_tier(max_rate):
+        if max_rate is None:
+            return tiers[-1]
+        slower = [tier for tier in tiers if tier.rate <= max_rate]
+        return slower[-1] if slower else tiers[0]
+
+    def subscribe(sid, max_rate=None):
+        unsubscribe(sid)
+        tier = pick_tier(max_rate)
+        tier.clients.add(sid)
+        client_tiers[sid] = tier
+        metrics.position_subscribers.set(len(client_tiers))
+        join_room(tier.room, sid=sid)
+        print(f"Client subscribed to positions at {tier.rate:g}/s ({len(client_tiers)} subscriber(s))")
+
+        if len(client_tiers) == 1:
+            # First subscriber: start detecting balls in every new frame again
+            detector = cv_module.get_detector()
+            detector.remove_listener(emit_positions)
+            detector.add_listener(emit_positions)
+            cv_module.get_detection_scheduler().start()
+
+        # Everyone else in the room already has the balls, the newcomer needs a keyframe first
+        send_keyframe(sid)
+
+    def unsubscribe(sid):
+        tier = client_tiers.pop(sid, None)
+        if tier is None:
+            return
+        tier.clients.discard(sid)
+        metrics.position_subscribers.set(len(client_tiers))
+        leave_room(tier.room, sid=sid)
+        print(f"Client unsubscribed from positions ({len(client_tiers)} subscriber(s))")
+
+        if not client_tiers:
+            # Nobody is watching, no reason to keep the detection workers busy
+            print("No position subscribers, pausing detection")
+            cv_module.get_detection_scheduler().stop()
+            cv_module.get_detector().remove_listener(emit_positions)
+
+    def send_keyframe(sid):
+        tier = client_tiers.get(sid)
+        message = tier.encoder.keyframe() if tier else None
+        if message is not None:
+            socketio.emit("ball-positions", message, to=sid)
+            metrics.bytes_sent.inc(len(message), client=sid)
 
     @socketio.on('connect')
     def handle_connect():
         print("Client connected")
+        metrics.socket_clients.inc()
 
     @socketio.on('disconnect')
     def handle_disconnect():
         print('Client disconnected')
+        unsubscribe(request.sid)
+        metrics.socket_clients.dec()
+        metrics.bytes_sent.remove(client=request.sid)
+
+    @socketio.on("subscribe-positions")
+    def handle_subscribe_positions(options=None):
+        """Start (or change the rate of) the position stream, options: {"max_rate": messages per second}."""
+        max_rate = options.get("max_rate") if isinstance(options, dict) else None
+        try:
+            max_rate = float(max_rate) if max_rate is not None else None
+        except (TypeError, ValueError):
+            max_rate = None
+        subscribe(request.sid, max_rate)
+
+    @socketio.on("unsubscribe-positions")
+    def handle_unsubscribe_positions():
+        unsubscribe(request.sid)
+
+    @socketio.on("request-keyframe")
+    def handle_request_keyframe():
+        # A client that joined late (or missed a message) needs every ball before the deltas make sense
+        send_keyframe(request.sid)
 
     @socketio.on("start-position-stream")
     def handle_start_position_stream():
+        # Older clients: subscribe at the fastest rate
         print("Start position stream event received")
-        global streaming_started
-        if streaming_started:
-            print("Position stream already started")
-            return
-        
-        print("Start mock stream")
-        streaming_started = True
-
-        def streaming_loop():
-            while True:
-                # Send actual balls from camera
-                ball_positions = cv_module.get_ball_positions()
-                if ball_positions:
-                    serializable_balls = []
-                    for ball in ball_positions:
-                        regular_int_ball = (int(ball[0]), int(ball[1]), ball[2])  # Convert to int for JSON serialization
-                        serializable_balls.append(regular_int_ball)
-
-                    socketio.emit("ball-positions", serializable_balls)
-                eventlet.sleep(0.05)
-
-        eventlet.spawn(streaming_loop)
+        subscribe(request.sid)
@@ -0,0 +1,59 @@
+"""
+Timing of the stages (color convert, blur, Hough, ...) inside the detectors.
+The detectors wrap their stages in `with stage("hough"):`. Outside of collect() that is a no-op
+apart from the context manager itself, so the wrappers stay in the production code path.
+
+    with stage_timing.collect() as durations:
+        detect_balls.get_ball_positions(frame)
+    durations  # {"color_convert": 0.0004, "blur": 0.0011, "hough": 0.0062, ...} in seconds
+
+Collection is per OS thread, so frames read and encoded on tpool threads at the same time don't mix
+their stages. The server reports collected stages as metrics (metrics.observe_stages).
+"""
+import time
+from contextlib import contextmanager
+
+import eventlet.patcher
+
+# Per OS thread, also when the threading module is monkey patched (green locals would be per greenthread)
+_local = eventlet.patcher.original("threading").local()
+
+
+@contextmanager
+def stage(name):
+    """Time the block as the named stage. A stage that runs several times adds up."""
+    durations = getattr(_local, "durations", None)
+    if durations is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        durations[name] = durations.get(name, 0.0) + time.perf_counter() - start
+
+
+@contextmanager
+def collect():
+    """
+    Collect the stage timings of the block, on this thread's call path. Stages a detector runs on other
+    threads (tiled detection) are collected there and handed back with add().
+    Yields:
+        dict: Stage name -> total seconds, filled in as the stages run.
+    """
+    previous = getattr(_local, "durations", None)
+    durations = _local.durations = {}
+    try:
+        yield durations
+    finally:
+        _local.durations = previous
+
+
+def add(durations):
+    """Add stage timings collected on another thread to the collection of this thread, if there is one."""
+    collected = getattr(_local, "durations", None)
+    if collected is None:
+        return
+    for name, seconds in durations.items():
+        collected[name] = collected.get(name, 0.0) + seconds
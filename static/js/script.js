@@ -9,6 +9,24 @@ canvas.style.opacity = "1";
 const zoomContainer = document.getElementById("zoom-container");
 const zoomWrapper = document.getElementById("zoom-wrapper");
 
+// The page URL can pin a video profile (e.g. /?video=low), otherwise the server picks one from our throughput
+const videoProfile = new URLSearchParams(window.location.search).get("video");
+if (videoProfile) {
+  liveVideoImage.src = `/get-live-video?profile=${encodeURIComponent(videoProfile)}`;
+}
+// In MJPEG pass-through mode the server streams the camera's own JPEGs unmirrored and we mirror them.
+// The camera can fall back to decoding (already mirrored frames) at any time, so we keep asking.
+async function updateVideoOrientation() {
+  try {
+    const response = await fetch("/get-video-orientation");
+    if (!response.ok) return;
+    const orientation = await response.json();
+    liveVideoImage.classList.toggle("mirrored", orientation.mirror);
+  } catch (error) {}
+}
+updateVideoOrientation();
+setInterval(updateVideoOrientation, 3000);
+
 
 let isDragging = false;
 let dragStart = { x: 0, y: 0 };
@@ -114,6 +132,7 @@ const zoomSlider = document.getElementById("zoom-slider");
 let transparency = parseFloat(transparencySlider.value);
 let zoom = parseFloat(zoomSlider.value);
 let lastCapturedImage = null; // store last image for live updates
+let lastCapturedMirrored = true; // false for an unmirrored pass-through JPEG, drawn mirrored
 
 // Event listeners for sliders
 transparencySlider.addEventListener("input", () => {
@@ -186,7 +205,16 @@ function drawImageOnCanvas() {
   const offsetY = (canvasHeight - scaledHeight) / 2;
 
   ctx.globalAlpha = transparency;
+  if (!lastCapturedMirrored) {
+    // An unmirrored camera JPEG (MJPEG pass-through). The image is centered, so it stays in place.
+    ctx.save();
+    ctx.translate(canvasWidth, 0);
+    ctx.scale(-1, 1);
+  }
   ctx.drawImage(lastCapturedImage, offsetX, offsetY, scaledWidth, scaledHeight);
+  if (!lastCapturedMirrored) {
+    ctx.restore();
+  }
   ctx.globalAlpha = 1.0;
 }
 
@@ -194,21 +222,25 @@ function drawImageOnCanvas() {
 // Update overlay and draw on canvas
 async function updateCapturedImage() {
     try {
-      const imageUrl = await getImageUrl();
-      if (!imageUrl) return;
+      // The newest frame we have positions for is (about) the frame on screen when Capture was pressed,
+      // the server returns it from its frame ring even if the balls have moved since
+      const image = await getImageUrl(positionsSeq);
+      if (!image) return;
+      const imageUrl = image.url;
 
       overlayImage.src = imageUrl;
+      lastCapturedMirrored = image.mirrored;
       lastCapturedImage = new Image();
       lastCapturedImage.onload = () => drawImageOnCanvas();
       lastCapturedImage.src = imageUrl;
     } catch (error) {}
 }
 
-// Fetch image from backend
-async function getImageUrl() {
+// Fetch image from backend, the frame nearest to seq if given. Returns its URL and if it is mirrored.
+async function getImageUrl(seq = null) {
     try {
       // Fetch the image from the backend
-      const response = await fetch("/get-image");
+      const response = await fetch(seq === null ? "/get-image" : `/get-image?seq=${seq}`);
 
       // If the response is not ok, throw an error
       if (!response.ok) {
@@ -223,7 +255,8 @@ async function getImageUrl() {
         URL.revokeObjectURL(overlayImage.src);
       }
 
-      return imageUrl;
+      // Every image says if it is mirrored already, it may be an unmirrored pass-through JPEG
+      return { url: imageUrl, mirrored: response.headers.get("X-Frame-Mirrored") !== "0" };
     } catch (error) {}
 }
 
@@ -1,6 +1,65 @@
 const socket = io();
 
-socket.emit("start-position-stream");
+// Binary ball position stream, see position_stream.py for the message layout
+const MSG_KEYFRAME = 1;
+const MSG_DELTA = 2;
+const FLAG_TABLE_COORDS = 0x80;
+const BALL_COLORS = ["Color", "white", "red", "yellow", "green", "brown", "blue", "pink", "black"];
 
-socket.on("ball-positions", (positions) => {
-})
\ No newline at end of file
+const balls = new Map(); // Ball id -> ball, as of the last message
+let haveKeyframe = false;
+let positionsSeq = null; // Frame seq of the positions
+let positionsTimestamp = null; // Capture time of that frame (unix seconds), tells how old the positions are
+
+// The page URL can cap the position rate (e.g. /?rate=5), otherwise the server sends at its fastest rate
+const maxPositionRate = new URLSearchParams(window.location.search).get("rate");
+
+socket.on("connect", () => {
+  // Subscriptions don't survive a reconnect, and our balls may be stale: subscribe again and wait for a keyframe
+  haveKeyframe = false;
+  socket.emit("subscribe-positions", maxPositionRate ? { max_rate: Number(maxPositionRate) } : {});
+});
+
+socket.on("ball-positions", (data) => {
+  const view = new DataView(data);
+  const type = view.getUint8(0);
+  const messageType = type & ~FLAG_TABLE_COORDS;
+  const hasTableCoords = (type & FLAG_TABLE_COORDS) !== 0;
+
+  if (messageType === MSG_DELTA && !haveKeyframe) {
+    socket.emit("request-keyframe");
+    return;
+  }
+  if (messageType === MSG_KEYFRAME) {
+    balls.clear();
+    haveKeyframe = true;
+  }
+
+  positionsSeq = view.getUint32(1, true);
+  positionsTimestamp = view.getFloat64(5, true);
+  const ballCount = view.getUint16(13, true);
+  const removedCount = view.getUint16(15, true);
+
+  let offset = 17;
+  for (let i = 0; i < ballCount; i++) {
+    const ball = {
+      id: view.getUint16(offset, true),
+      x: view.getInt16(offset + 2, true),
+      y: view.getInt16(offset + 4, true),
+      color: BALL_COLORS[view.getUint8(offset + 6)] || "Color",
+    };
+    offset += 7;
+    if (hasTableCoords) {
+      ball.tableX = view.getInt16(offset, true);
+      ball.tableY = view.getInt16(offset + 2, true);
+      offset += 4;
+    }
+    balls.set(ball.id, ball);
+  }
+  for (let i = 0; i < removedCount; i++) {
+    balls.delete(view.getUint16(offset, true));
+    offset += 2;
+  }
+
+  livePositions = Array.from(balls.values());
+});
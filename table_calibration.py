@@ -0,0 +1,176 @@
+"""
+Persisted calibration of where the table bed is in the camera frame.
+Detection crops frames to the playing surface (crop rectangle), or rectifies it to a top-down
+view (four corner points) with remap maps that are computed once when the calibration is loaded.
+All coordinates are in the flipped orientation of the frames published by cv_module.
+
+calibration/table.json:
+    {
+        "crop": [x, y, width, height],                  # optional
+        "corners": [[x, y], [x, y], [x, y], [x, y]],    # optional, top-left, top-right, bottom-right, bottom-left
+        "table_size_mm": [3569, 1778]                   # playing surface size used for table coordinates
+    }
+"""
+import json
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import settings
+
+# Playing surface of a full size snooker table
+TABLE_SIZE_MM = (3569, 1778)
+
+
+class TableCalibration:
+    """
+    Maps between camera frame pixels, the (cropped or rectified) detection image and table coordinates (mm).
+    """
+
+    def __init__(self, crop=None, corners=None, table_size_mm=TABLE_SIZE_MM):
+        self.crop = tuple(int(v) for v in crop) if crop else None
+        self.corners = np.array(corners, dtype=np.float32) if corners else None
+        self.table_size_mm = tuple(table_size_mm)
+        self._maps = None
+        self._to_frame = None
+        self._to_table = None
+
+        if self.corners is not None:
+            self._prepare_rectification()
+
+    @property
+    def rectifies(self):
+        return self.corners is not None
+
+    def _prepare_rectification(self):
+        tl, tr, br, bl = self.corners
+        # Keep roughly the camera's pixel scale, so the ball radius limits of the detectors still hold
+        width = int(round((np.linalg.norm(tr - tl) + np.linalg.norm(br - bl)) / 2))
+        height = int(round((np.linalg.norm(bl - tl) + np.linalg.norm(br - tr)) / 2))
+        self.rectified_size = (width, height)
+
+        rectified_corners = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+        to_rectified = cv2.getPerspectiveTransform(self.corners, rectified_corners)
+        self._to_frame = np.linalg.inv(to_rectified)
+
+        table_w, table_h = self.table_size_mm
+        self._to_table = np.array([[table_w / (width - 1), 0, 0], [0, table_h / (height - 1), 0], [0, 0, 1]]) @ to_rectified
+
+        # Frame coordinates of every rectified pixel, computed once so detection_image() is a single remap
+        xs, ys = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        grid = np.stack([xs, ys], axis=-1).reshape(-1, 1, 2)
+        source = cv2.perspectiveTransform(grid, self._to_frame).reshape(height, width, 2)
+        self._maps = cv2.convertMaps(source[..., 0], source[..., 1], cv2.CV_16SC2)
+
+    def detection_image(self, frame, dst=None):
+        """
+        Get the part of the frame detection should look at.
+        Args:
+            dst (np.ndarray | None): Buffer of the rectified size to write the rectified table into.
+        Returns:
+            np.ndarray: The rectified table, a view of the crop rectangle, or the frame itself.
+        """
+        if self._maps is not None:
+            return cv2.remap(frame, self._maps[0], self._maps[1], cv2.INTER_LINEAR, dst=dst)
+        if self.crop is not None:
+            x, y, w, h = self.crop
+            return frame[y : y + h, x : x + w]
+        return frame
+
+    def to_frame_coords(self, points):
+        """
+        Convert (x, y) points of the detection image back to frame pixels.
+        Returns:
+            list: List of (x, y) int tuples.
+        """
+        if not points:
+            return []
+        if self._to_frame is not None:
+            mapped = cv2.perspectiveTransform(np.array(points, dtype=np.float32).reshape(-1, 1, 2), self._to_frame)
+            return [(int(round(x)), int(round(y))) for x, y in mapped.reshape(-1, 2)]
+        if self.crop is not None:
+            x0, y0 = self.crop[:2]
+            return [(int(x) + x0, int(y) + y0) for x, y in points]
+        return [(int(x), int(y)) for x, y in points]
+
+    def to_table_coords(self, points):
+        """
+        Convert (x, y) frame pixels to table coordinates in mm, origin at the top-left corner.
+        Returns:
+            list | None: List of (x, y) int tuples, or None if the corners are not calibrated.
+        """
+        if self._to_table is None:
+            return None
+        if not points:
+            return []
+        mapped = cv2.perspectiveTransform(np.array(points, dtype=np.float32).reshape(-1, 1, 2), self._to_table)
+        return [(int(round(x)), int(round(y))) for x, y in mapped.reshape(-1, 2)]
+
+    def to_dict(self):
+        data = {"table_size_mm": list(self.table_size_mm)}
+        if self.crop is not None:
+            data["crop"] = list(self.crop)
+        if self.corners is not None:
+            data["corners"] = self.corners.tolist()
+        return data
+
+
+def load(path=None):
+    """
+    Load the table calibration.
+    Returns:
+        TableCalibration | None: The calibration, or None if the file doesn't exist.
+    """
+    path = Path(path or settings.TABLE_CALIBRATION_FILE)
+    if not path.exists():
+        return None
+
+    try:
+        data = json.loads(path.read_text())
+        return TableCalibration(data.get("crop"), data.get("corners"), data.get("table_size_mm", TABLE_SIZE_MM))
+    except (ValueError, TypeError) as e:
+        print(f"Error loading table calibration from {path}: {e}")
+        return None
+
+
+def save(calibration, path=None):
+    """
+    Save the table calibration, replacing the file. A crop saved after the corners replaces them, the corners
+    would otherwise still win over it.
+    """
+    path = Path(path or settings.TABLE_CALIBRATION_FILE)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(calibration.to_dict(), indent=4))
+    print(f"Table calibration saved to {path}")
+
+
+_calibration: TableCalibration | None = None
+_loaded = False
+_loaded_mtime = None
+
+
+def _mtime():
+    try:
+        return os.stat(settings.TABLE_CALIBRATION_FILE).st_mtime
+    except OSError:
+        return None
+
+
+def get_calibration():
+    """
+    Get the table calibration (loaded on first use, and again when the file changes, e.g. saved by utils.py
+    while the server runs).
+    Returns:
+        TableCalibration | None: The calibration, or None if the table is not calibrated.
+    """
+    global _calibration, _loaded, _loaded_mtime
+    mtime = _mtime()
+    if not _loaded or mtime != _loaded_mtime:
+        _calibration = load()
+        _loaded, _loaded_mtime = True, mtime
+        if _calibration is not None:
+            mode = "rectifying" if _calibration.rectifies else "cropping"
+            print(f"Table calibration loaded, {mode} frames for detection")
+    return _calibration
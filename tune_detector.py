@@ -0,0 +1,247 @@
+"""
+Tune the detector parameters on a labelled dataset (see ground_truth.py) and save the winner
+to calibration/detector_params.json, which the detectors load at startup (detector_params.py).
+
+1. HSV color ranges are measured from the annotated balls: detect_balls gets ranges of the
+   averaged patch colors it classifies, ball_recognition_test ranges of the ball pixels it masks.
+2. HoughCircles and preprocessing parameters of detect_balls are searched in a process pool,
+   every configuration scored on accuracy (F1 of precision and recall, color accuracy) and per frame cost.
+
+After a lighting change, record and annotate a few frames, then run:
+    python tune_detector.py --dataset datasets/hall [--trials 100] [--max-ms 15]
+"""
+import argparse
+import itertools
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import ball_recognition_test
+import detect_balls
+import detector_params
+import ground_truth
+
+# Values tried for every detect_balls parameter. A random subset of the combinations is scored.
+SEARCH_SPACE = {
+    "hough": {
+        "dp": [1.2, 1.5, 2.0],
+        "minDist": [15, 20, 30],
+        "param1": [100, 150, 200, 250],
+        "param2": [0.8, 0.85, 0.9],
+        "minRadius": [16, 18, 20, 22],
+        "maxRadius": [28, 30, 32],
+    },
+    "preprocess": {
+        "alpha": [1.0, 1.4, 1.8],
+        "beta": [0, 10, 20],
+        "blur_sigma": [1, 2, 3],
+    },
+}
+
+
+def _recognition_names(color):
+    """
+    Names a snooker color has in ball_recognition_test.BALL_COLOR_RANGES (see ground_truth.COLOR_ALIASES).
+    Red is there twice, as "red" and "dark_red".
+    Returns:
+        list: The names, the snooker name first if it is one of them. Just the snooker name if it has none.
+    """
+    names = [name for name in ball_recognition_test.BALL_COLOR_RANGES if ground_truth.COLOR_ALIASES.get(name, name) == color]
+    return sorted(names, key=lambda name: name != color) or [color]
+
+
+# HSV margins added around the measured ranges, so the ranges don't end exactly at the darkest / brightest sample
+_HSV_MARGIN = np.array([3, 15, 15])
+
+
+def hsv_ranges(samples, low_percentile=1, high_percentile=99):
+    """
+    HSV range(s) covering the samples of one color.
+    Hue wraps around at 180, a range crossing it is split in two. Colors without a meaningful hue
+    (white, black) get the full hue range.
+    Returns:
+        list: One or two ((h, s, v), (h, s, v)) lower / upper ranges.
+    """
+    samples = np.asarray(samples, dtype=float)
+    low = np.percentile(samples, low_percentile, axis=0) - _HSV_MARGIN
+    high = np.percentile(samples, high_percentile, axis=0) + _HSV_MARGIN
+    s_low, v_low = np.clip(low[1:], 0, 255).astype(int).tolist()
+    s_high, v_high = np.clip(high[1:], 0, 255).astype(int).tolist()
+
+    # Measure the hue spread as is and rotated by 90, the narrower one doesn't cross the wrap around
+    shifted = (samples[:, 0] + 90) % 180
+    shifted_low = np.percentile(shifted, low_percentile) - _HSV_MARGIN[0]
+    shifted_high = np.percentile(shifted, high_percentile) + _HSV_MARGIN[0]
+    plain_width = high[0] - low[0]
+    shifted_width = shifted_high - shifted_low
+
+    if min(plain_width, shifted_width) > 90:
+        return [((0, s_low, v_low), (179, s_high, v_high))]
+    if plain_width <= shifted_width:
+        h_low, h_high = max(0, int(low[0])), min(179, int(np.ceil(high[0])))
+        return [((h_low, s_low, v_low), (h_high, s_high, v_high))]
+    return [
+        ((max(0, int(shifted_low) + 90), s_low, v_low), (179, s_high, v_high)),
+        ((0, s_low, v_low), (min(179, int(np.ceil(shifted_high)) - 90), s_high, v_high)),
+    ]
+
+
+def _patch_color(frame, x, y, half=10):
+    """Average HSV color of the patch detect_balls classifies a ball by."""
+    patch = frame[max(y - half, 0) : y + half, max(x - half, 0) : x + half].reshape(-1, 3)
+    mean = patch.mean(axis=0).astype(np.uint8)
+    return cv2.cvtColor(mean[None, None], cv2.COLOR_BGR2HSV)[0, 0]
+
+
+def _ball_pixels(hsv_frame, x, y, radius=14):
+    """HSV pixels of the inner part of a ball, where ball_recognition_test's masks should hit."""
+    h, w = hsv_frame.shape[:2]
+    ys, xs = np.ogrid[-radius : radius + 1, -radius : radius + 1]
+    dy, dx = np.nonzero(xs ** 2 + ys ** 2 <= radius ** 2)
+    py, px = dy - radius + y, dx - radius + x
+    inside = (py >= 0) & (py < h) & (px >= 0) & (px < w)
+    return hsv_frame[py[inside], px[inside]]
+
+
+def measure_color_ranges(dataset, max_pixels=20000, seed=0):
+    """
+    Measure the color ranges of both detectors from the annotated balls.
+    Returns:
+        tuple: (detect_balls COLOR_RANGES, ball_recognition_test BALL_COLOR_RANGES entries)
+    """
+    patch_colors: dict[str, list] = {}
+    pixels: dict[str, list] = {}
+    for _, frame, balls in dataset:
+        hsv_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        for x, y, color in balls:
+            patch_colors.setdefault(color, []).append(_patch_color(frame, x, y))
+            pixels.setdefault(color, []).append(_ball_pixels(hsv_frame, x, y))
+
+    rng = np.random.default_rng(seed)
+    color_ranges = {}
+    recognition_ranges = {}
+    for color in patch_colors:
+        color_ranges[color] = hsv_ranges(patch_colors[color])
+
+        color_pixels = np.concatenate(pixels[color])
+        if len(color_pixels) > max_pixels:
+            color_pixels = color_pixels[rng.choice(len(color_pixels), max_pixels, replace=False)]
+        ranges = hsv_ranges(color_pixels)
+        # The tuned range replaces every range of the color: it goes to one name, the others are removed
+        # (None), or a stale hand-set range would keep matching next to it
+        name, *others = _recognition_names(color)
+        recognition_ranges[name] = {
+            key: list(bound) for i, (low, high) in enumerate(ranges, 1) for key, bound in ((f"low{i}", low), (f"high{i}", high))
+        }
+        recognition_ranges.update(dict.fromkeys(others))
+
+    # Ranges are checked in order and the first match wins, so the tightest ranges go first
+    def volume(item):
+        return sum(np.prod(np.subtract(high, low) + 1) for low, high in item[1])
+    color_ranges = dict(sorted(color_ranges.items(), key=volume))
+    return color_ranges, recognition_ranges
+
+
+def candidate_configs(trials, seed=0):
+    """
+    Returns:
+        list: The current parameters followed by up to trials - 1 random combinations of SEARCH_SPACE.
+    """
+    names = [(section, name) for section, params in SEARCH_SPACE.items() for name in params]
+    values = [SEARCH_SPACE[section][name] for section, name in names]
+    grid = [combination for combination in itertools.product(*values)]
+    # A radius range the other way around finds nothing
+    grid = [c for c in grid if c[names.index(("hough", "minRadius"))] < c[names.index(("hough", "maxRadius"))]]
+    random.Random(seed).shuffle(grid)
+
+    current = {"hough": dict(detect_balls.HOUGH_PARAMS), "preprocess": dict(detect_balls.PREPROCESS_PARAMS)}
+    configs = [current]
+    for combination in grid[: max(0, trials - 1)]:
+        config = {"hough": {}, "preprocess": {}}
+        for (section, name), value in zip(names, combination):
+            config[section][name] = value
+        configs.append(config)
+    return configs
+
+
+_dataset = None
+_max_distance = None
+
+
+def _init_worker(dataset_path, color_ranges, max_distance):
+    global _dataset, _max_distance
+    # One core per configuration, like the detection workers
+    cv2.setNumThreads(1)
+    _dataset = ground_truth.load_dataset(dataset_path)
+    _max_distance = max_distance
+    detect_balls.set_color_ranges(color_ranges)
+
+
+def _evaluate(config):
+    detect_balls.HOUGH_PARAMS.update(config["hough"])
+    detect_balls.PREPROCESS_PARAMS.update(config["preprocess"])
+    score = ground_truth.score_detector(detect_balls.get_ball_positions, _dataset, _max_distance)
+    precision, recall = score["precision"], score["recall"]
+    score["f1"] = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return score
+
+
+def rank(results, max_ms=None):
+    """
+    Order the scored configurations best first: F1, then color accuracy, then per frame cost.
+    Configurations slower than max_ms (p50) are left out.
+    """
+    if max_ms is not None:
+        results = [r for r in results if r[1]["frame_ms"]["p50"] <= max_ms]
+    return sorted(results, key=lambda r: (-round(r[1]["f1"], 3), -round(r[1]["color_accuracy"], 3), r[1]["frame_ms"]["p50"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="datasets/synthetic")
+    parser.add_argument("--trials", type=int, default=60, help="Number of configurations to score")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes scoring configurations in parallel")
+    parser.add_argument("--max-ms", type=float, help="Only accept configurations with a p50 frame time below this")
+    parser.add_argument("--max-distance", type=float, default=15, help="Max center distance (px) of a match")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true", help="Don't save the winner")
+    args = parser.parse_args()
+
+    dataset = ground_truth.load_dataset(args.dataset)
+    if not dataset:
+        print(f"No frames in {args.dataset}")
+        return
+
+    color_ranges, recognition_ranges = measure_color_ranges(dataset, seed=args.seed)
+    print(f"Measured color ranges of {len(color_ranges)} colors from {sum(len(b) for _, _, b in dataset)} balls")
+
+    configs = candidate_configs(args.trials, args.seed)
+    print(f"Scoring {len(configs)} configurations on {len(dataset)} frames with {args.workers} workers")
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(args.dataset, color_ranges, args.max_distance)) as pool:
+        results = list(zip(configs, pool.map(_evaluate, configs)))
+
+    ranked = rank(results, args.max_ms)
+    if not ranked:
+        print(f"No configuration is faster than {args.max_ms} ms")
+        return
+
+    print(f"\n{'':>3} {'f1':>6} {'color acc':>9} {'p50 ms':>7}  parameters")
+    for i, (config, score) in enumerate(ranked[:10], 1):
+        current = " (current)" if config is configs[0] else ""  # configs[0] holds the parameters in use
+        params = ", ".join(f"{name}={value}" for section in config.values() for name, value in section.items())
+        print(f"{i:>3} {score['f1']:>6.3f} {score['color_accuracy']:>9.3f} {score['frame_ms']['p50']:>7.2f}  {params}{current}")
+
+    if args.dry_run:
+        return
+    best, _ = ranked[0]
+    detector_params.save({
+        "detect_balls": {"hough": best["hough"], "preprocess": best["preprocess"], "color_ranges": color_ranges},
+        "ball_recognition": {"color_ranges": recognition_ranges},
+    })
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import cv2
 from time import sleep
+import table_calibration
 
 
 def set_brightness_contrast(frame):
@@ -118,7 +119,8 @@ def show_video():
 def show_cropped_video():
     """
     Display live video feed from the camera with adjustable crop area using trackbars.
-    Press 'q' to quit, 'k' to print current crop area.
+    Frames are flipped like in cv_module, so the crop area can be used for detection as is.
+    Press 'q' to quit, 'k' to print current crop area, 's' to save it as the table calibration.
     """
 
     def nothing(x):
@@ -140,13 +142,14 @@ def show_cropped_video():
     cv2.createTrackbar("Width", "Cropped Video Feed", width, width, nothing)
     cv2.createTrackbar("Height", "Cropped Video Feed", height, height, nothing)
 
-    print("Press 'q' to quit, 'k' to print current crop area")
+    print("Press 'q' to quit, 'k' to print current crop area, 's' to save it as the table calibration")
 
     while True:
         ret, frame = camera.read()
         if not ret:
             print("Error: Could not read frame")
             break
+        frame = cv2.flip(frame, 1)
 
         x = cv2.getTrackbarPos("X", "Cropped Video Feed")
         y = cv2.getTrackbarPos("Y", "Cropped Video Feed")
@@ -168,6 +171,8 @@ def show_cropped_video():
         key = cv2.waitKey(1) & 0xFF
         if key == ord("k"):
             print(f"Current crop area: ({x}, {y}, {w}, {h})")
+        elif key == ord("s"):
+            table_calibration.save(table_calibration.TableCalibration(crop=(x, y, w, h)))
         elif key == ord("q"):
             break
 
@@ -175,6 +180,61 @@ def show_cropped_video():
     cv2.destroyAllWindows()
 
 
+def pick_table_corners():
+    """
+    Click the four corners of the playing surface on a (flipped) camera frame to calibrate the table.
+    Click order: top-left, top-right, bottom-right, bottom-left.
+    Press 'r' to start over, 's' to save the corners as the table calibration, 'q' to quit.
+    """
+    camera = cv2.VideoCapture(0)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    sleep(0.3)  # Allow camera to warm up
+    if not camera.isOpened():
+        print("Error: Could not open camera")
+        return
+    ret, frame = camera.read()
+    camera.release()
+    if not ret:
+        print("Error: Could not read frame from camera")
+        return
+    frame = cv2.flip(frame, 1)
+
+    corners = []
+
+    def on_click(event, x, y, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN and len(corners) < 4:
+            corners.append((x, y))
+            print(f"Corner {len(corners)}: ({x}, {y})")
+
+    cv2.namedWindow("Table Corners")
+    cv2.setMouseCallback("Table Corners", on_click)
+    print("Click top-left, top-right, bottom-right and bottom-left corners. 'r' to reset, 's' to save, 'q' to quit")
+
+    while True:
+        preview = frame.copy()
+        for i, corner in enumerate(corners):
+            cv2.circle(preview, corner, 5, (0, 0, 255), -1)
+            if i > 0:
+                cv2.line(preview, corners[i - 1], corner, (0, 255, 0), 2)
+        if len(corners) == 4:
+            cv2.line(preview, corners[3], corners[0], (0, 255, 0), 2)
+        cv2.imshow("Table Corners", preview)
+
+        key = cv2.waitKey(20) & 0xFF
+        if key == ord("r"):
+            corners.clear()
+        elif key == ord("s"):
+            if len(corners) == 4:
+                table_calibration.save(table_calibration.TableCalibration(corners=corners))
+            else:
+                print("Click all four corners before saving")
+        elif key == ord("q"):
+            break
+
+    cv2.destroyAllWindows()
+
+
 
 
 